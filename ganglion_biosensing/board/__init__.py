@@ -1 +1,2 @@
 from .ganglion import GanglionBoard, OpenBCISample
+from .samples import SampleFormat, SampleRecorder, pack_samples, sample_dtype
@@ -0,0 +1,246 @@
+"""
+Archiving of raw Ganglion packets, and parallel offline re-decoding of such
+archives.
+
+Archives consist of a short header followed by fixed-size records, each
+holding the arrival time and contents of a single BLE notification. Fixed
+size records allow archives to be memory-mapped and split without parsing
+them sequentially.
+
+Archives can be decoded from the command line:
+
+    python -m ganglion_biosensing.board.archive capture.raw decoded.npz
+"""
+import argparse
+import logging
+import os
+import struct
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from ganglion_biosensing.board.board import OpenBCISample
+from ganglion_biosensing.board.ganglion import _GanglionDelegate
+
+_ARCHIVE_MAGIC = b'GANGLIONRAW1'
+_MAX_PACKET_LEN = 20
+
+_RECORD_DTYPE = np.dtype([
+    ('arrival_time', '<f8'),
+    ('length', 'u1'),
+    ('data', 'u1', (_MAX_PACKET_LEN,))
+])
+_RECORD_STRUCT = struct.Struct(f'<dB{_MAX_PACKET_LEN}s')
+
+
+class RawPacketWriter:
+    """
+    Writes raw packets to an archive. Instances are callables which can be
+    passed directly to GanglionBoard.set_raw_callback().
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the archive. Packets are appended to it if it
+        already exists, after any partial record left by an interrupted
+        capture.
+        """
+        self._lock = threading.Lock()
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new_file:
+            with open(path, 'rb') as fp:
+                if fp.read(len(_ARCHIVE_MAGIC)) != _ARCHIVE_MAGIC:
+                    raise ValueError(f'{path} is not a raw Ganglion packet '
+                                     f'archive.')
+
+        self._file = open(path, 'r+b' if not new_file else 'wb')
+        if new_file:
+            self._file.write(_ARCHIVE_MAGIC)
+        else:
+            # drop a trailing partial record, to keep records aligned
+            size = os.path.getsize(path) - len(_ARCHIVE_MAGIC)
+            self._file.seek(len(_ARCHIVE_MAGIC) +
+                            size - size % _RECORD_DTYPE.itemsize)
+            self._file.truncate()
+
+    def __call__(self, arrival_time: float, data: bytes) -> None:
+        data = bytes(data[:_MAX_PACKET_LEN])
+        with self._lock:
+            self._file.write(
+                _RECORD_STRUCT.pack(arrival_time, len(data), data))
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self) -> 'RawPacketWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+def read_packets(path: str) -> np.ndarray:
+    """
+    Memory-maps an archive. A trailing partial record, as left by an
+    interrupted capture, is ignored with a warning.
+
+    :return: Structured array with fields arrival_time, length and data.
+    """
+    with open(path, 'rb') as fp:
+        if fp.read(len(_ARCHIVE_MAGIC)) != _ARCHIVE_MAGIC:
+            raise ValueError(f'{path} is not a raw Ganglion packet archive.')
+
+    size = os.path.getsize(path) - len(_ARCHIVE_MAGIC)
+    count, trailing = divmod(size, _RECORD_DTYPE.itemsize)
+    if trailing > 0:
+        warnings.warn(f'{path} ends with a partial record ({trailing} '
+                      f'bytes), ignoring it.')
+
+    if count == 0:
+        return np.empty(0, dtype=_RECORD_DTYPE)
+
+    return np.memmap(path, dtype=_RECORD_DTYPE, mode='r',
+                     offset=len(_ARCHIVE_MAGIC), shape=(count,))
+
+
+class DecodedArchive(NamedTuple):
+    timestamps: np.ndarray
+    seq: np.ndarray
+    pkt_id: np.ndarray
+    channel_data: np.ndarray  # shape (samples, 4), NaN for lost samples
+    dropped_packets: int
+
+
+class _ChunkResult(NamedTuple):
+    decoded: DecodedArchive
+    sample_count: int
+
+
+def _decode_chunk(path: str, start: int, stop: int) -> _ChunkResult:
+    """
+    Decodes records [start, stop) of an archive, numbering samples from 0.
+
+    Uncompressed packets are only sent at the start of a stream, so the
+    decoder is restarted on each of them, and the timestamps of each stream
+    are fitted independently.
+    """
+    samples: List[OpenBCISample] = []
+    delegate = _GanglionDelegate(samples.append)
+
+    records = read_packets(path)[start:stop]
+    for arrival_time, length, data in zip(records['arrival_time'],
+                                          records['length'],
+                                          records['data']):
+        if length > 0 and data[0] == 0:
+            delegate.restart()
+        delegate.decode(data[:length].tobytes(), float(arrival_time))
+
+    decoded = DecodedArchive(
+        timestamps=np.array([s.timestamp for s in samples], dtype=np.float64),
+        seq=np.array([s.seq for s in samples], dtype=np.int64),
+        pkt_id=np.array([s.pkt_id for s in samples], dtype=np.int16),
+        channel_data=np.array([s.channel_data for s in samples],
+                              dtype=np.float64).reshape(-1, 4),
+        dropped_packets=delegate.dropped_packets
+    )
+    return _ChunkResult(decoded, delegate.sample_count)
+
+
+def _split_points(records: np.ndarray, chunks: int) -> List[Tuple[int, int]]:
+    """
+    Splits the records into at most the given number of ranges of similar
+    size, starting at uncompressed packets (except for the first range).
+    Decoding restarts from scratch at uncompressed packets, so each range
+    can be decoded independently.
+    """
+    total = len(records)
+    keyframes = np.flatnonzero((records['length'] > 0) &
+                               (records['data'][:, 0] == 0))
+    keyframes = keyframes[keyframes > 0]
+
+    targets = np.linspace(0, total, chunks + 1)[1:-1]
+    idx = np.searchsorted(keyframes, targets)
+    splits = np.unique(keyframes[idx[idx < len(keyframes)]])
+
+    bounds = [0] + splits.tolist() + [total]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def decode_archive(path: str,
+                   workers: Optional[int] = None,
+                   chunks_per_worker: int = 4) -> DecodedArchive:
+    """
+    Decodes an archive of raw packets, in parallel across processes.
+
+    The archive is split at uncompressed packets, which mark the start of a
+    new stream from the board and where the decoder is restarted (see
+    _decode_chunk()), and the resulting chunks are decoded independently in
+    a process pool. The results are then stitched together, offsetting the
+    sample sequence numbers of each chunk by the number of samples in the
+    preceding ones. Note that the achievable parallelism is bounded by the
+    number of uncompressed packets in the archive, which the Ganglion sends
+    at the start of every stream.
+
+    As the decoder doesn't carry any state across stream starts, the result
+    is identical to that of decoding the whole archive sequentially.
+
+    :param path: Path of the archive.
+    :param workers: Number of worker processes, defaults to the CPU count.
+    :param chunks_per_worker: Number of chunks to split the archive into per
+    worker, for load balancing.
+    :return: The decoded samples.
+    """
+    workers = workers or os.cpu_count() or 1
+    records = read_packets(path)
+    if workers == 1:
+        ranges = [(0, len(records))]
+    else:
+        ranges = _split_points(records, workers * chunks_per_worker)
+    del records
+
+    logger = logging.getLogger('decode_archive')
+    logger.info(f'Decoding {path} in {len(ranges)} chunks '
+                f'on {workers} workers.')
+
+    if len(ranges) == 1:
+        results = [_decode_chunk(path, start, stop) for start, stop in ranges]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_decode_chunk,
+                                    [path] * len(ranges),
+                                    [start for start, _ in ranges],
+                                    [stop for _, stop in ranges]))
+
+    offsets = np.cumsum([0] + [r.sample_count for r in results[:-1]])
+    return DecodedArchive(
+        timestamps=np.concatenate([r.decoded.timestamps for r in results]),
+        seq=np.concatenate([r.decoded.seq + offset
+                            for r, offset in zip(results, offsets)]),
+        pkt_id=np.concatenate([r.decoded.pkt_id for r in results]),
+        channel_data=np.concatenate([r.decoded.channel_data
+                                     for r in results]),
+        dropped_packets=sum(r.decoded.dropped_packets for r in results)
+    )
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description='Decode an archive of raw Ganglion packets in parallel.')
+    parser.add_argument('archive', help='Path of the raw packet archive.')
+    parser.add_argument('output', help='Path of the output .npz file.')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Number of worker processes '
+                             '(default: number of CPUs).')
+    parsed = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO)
+    decoded = decode_archive(parsed.archive, workers=parsed.workers)
+    np.savez(parsed.output, **decoded._asdict())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,26 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import queue
 import threading
+import time
 from abc import abstractmethod
+from collections import deque
 from contextlib import AbstractContextManager
 from enum import Enum
-from typing import Any, Callable, NamedTuple
+from typing import Any, AsyncIterator, Callable, Iterator, List, NamedTuple, \
+    Optional, Sequence, Set, TYPE_CHECKING, Tuple
 
 import numpy as np
 
+from ganglion_biosensing.board.samples import SampleFormat, \
+    SampleRecorder, pack_samples
+from ganglion_biosensing.util.profiling import Profiler, Stage
+
+if TYPE_CHECKING:
+    from ganglion_biosensing.processing.epochs import EpochExtractor
+
 
 class OpenBCISample(NamedTuple):
     timestamp: float
@@ -17,25 +29,353 @@ class OpenBCISample(NamedTuple):
     channel_data: np.ndarray
 
 
+class AccelSample(NamedTuple):
+    timestamp: float
+    seq: int  # of the EEG sample this reading is aligned with
+    accel_data: np.ndarray  # X, Y, Z, in g
+
+
+class ImpedanceSample(NamedTuple):
+    timestamp: float
+    channel: int  # 0 for the reference electrode
+    impedance: float  # in ohms
+
+
+# pkt_id of the single NaN sample emitted after a connection has been
+# re-established. The marker carries the timestamp at which the outage
+# started, and the seq of the first sample after the outage indicates how many
+# samples were lost.
+GAP_MARKER_PKT_ID = -2
+
+# channel data of samples which were lost or couldn't be decoded. A single
+# read-only array is shared by all such samples, to avoid an allocation each.
+NAN_CHANNEL_DATA = np.full(4, np.nan)
+NAN_CHANNEL_DATA.flags.writeable = False
+
+
+# interval at which blocked iterators check whether the board is still
+# streaming
+_POLL_INTERVAL = 0.1
+
+
 class BoardType(Enum):
     GANGLION = 0
     CYTON = 1
 
 
+class SampleBuffer:
+    """
+    Bounded, thread-safe FIFO buffer of samples. When full, the oldest samples
+    are discarded to make space for new ones.
+
+    Offers a queue.Queue-like get() interface, plus methods for retrieving
+    whole blocks of samples at once.
+    """
+
+    def __init__(self, maxlen: int):
+        self._samples = deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+        self._async_waiters: Set[Tuple[asyncio.AbstractEventLoop,
+                                       asyncio.Event]] = set()
+        self._dropped = 0
+
+    def put(self, sample: OpenBCISample) -> None:
+        with self._cond:
+            if len(self._samples) == self._samples.maxlen:
+                self._dropped += 1
+            self._samples.append(sample)
+            self._cond.notify_all()
+            waiters = tuple(self._async_waiters)
+
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # event loop was closed
+                pass
+
+    def get(self, block: bool = True,
+            timeout: Optional[float] = None) -> OpenBCISample:
+        """
+        Removes and returns the oldest sample in the buffer, with the same
+        semantics as queue.Queue.get().
+        """
+        with self._cond:
+            if block and not self._cond.wait_for(
+                    lambda: len(self._samples) > 0, timeout):
+                raise queue.Empty()
+            elif len(self._samples) == 0:
+                raise queue.Empty()
+            return self._samples.popleft()
+
+    def get_block(self, size: int,
+                  timeout: Optional[float] = None) -> List[OpenBCISample]:
+        """
+        Removes and returns up to size samples from the buffer, waiting at
+        most timeout seconds for the block to fill up. The returned block
+        might be shorter (or empty) if the timeout expires.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._samples) >= size, timeout)
+            return [self._samples.popleft()
+                    for _ in range(min(size, len(self._samples)))]
+
+    def add_async_waiter(self, loop: asyncio.AbstractEventLoop,
+                         event: asyncio.Event) -> None:
+        with self._cond:
+            self._async_waiters.add((loop, event))
+
+    def remove_async_waiter(self, loop: asyncio.AbstractEventLoop,
+                            event: asyncio.Event) -> None:
+        with self._cond:
+            self._async_waiters.discard((loop, event))
+
+    def qsize(self) -> int:
+        return len(self._samples)
+
+    def empty(self) -> bool:
+        return len(self._samples) == 0
+
+    @property
+    def dropped(self) -> int:
+        """
+        Number of samples discarded because the buffer was full.
+        """
+        return self._dropped
+
+
 class BaseBiosensingBoard(AbstractContextManager):
+    # whether the channel data of the samples delivered by the board is in
+    # ADC counts, as opposed to microvolts
+    _SAMPLES_IN_COUNTS = False
 
-    def __init__(self):
+    def __init__(self, buffer_size: int = 2048):
         self._logger = logging.getLogger(self.__class__.__name__)
         self._callback_lock = threading.RLock()
         self._sample_callback = self._default_callback
+        self._buffer = SampleBuffer(buffer_size)
+        self._profiler: Optional[Profiler] = None
+        self._epoch_extractors: List[EpochExtractor] = []
+        self._recorders: List[SampleRecorder] = []
 
     def set_callback(self, callback: Callable[[OpenBCISample], Any]) -> None:
         with self._callback_lock:
             self._sample_callback = callback
 
+    def set_profiler(self, profiler: Optional[Profiler]) -> None:
+        """
+        Attaches a profiler to the acquisition path of this board, or detaches
+        it if None. Can be called at any time, including while streaming.
+        """
+        self._profiler = profiler
+
     def _default_callback(self, sample):
         self._logger.debug(f'Default callback: {sample}')
 
+    def _dispatch_sample(self, sample: OpenBCISample) -> None:
+        """
+        Called by the acquisition threads for every new sample. Stores it in
+        the internal buffer and invokes the user callback.
+        """
+        for recorder in self._recorders:
+            recorder(sample)
+        self._forward_sample(sample)
+
+    def _dispatch_invalid(self, timestamps: np.ndarray, first_seq: int,
+                          pkt_ids: np.ndarray) -> None:
+        """
+        Called by the acquisition threads for a block of consecutive samples
+        which were lost or couldn't be decoded. These are written to the
+        recorders as masked records in one go, and forwarded to the other
+        consumers as samples sharing NAN_CHANNEL_DATA.
+        """
+        for recorder in self._recorders:
+            recorder.extend_invalid(timestamps, first_seq, pkt_ids)
+
+        for i, (timestamp, pkt_id) in enumerate(zip(timestamps.tolist(),
+                                                    pkt_ids.tolist())):
+            self._forward_sample(OpenBCISample(timestamp, first_seq + i,
+                                               pkt_id, NAN_CHANNEL_DATA))
+
+    def _forward_sample(self, sample: OpenBCISample) -> None:
+        self._buffer.put(sample)
+        for extractor in self._epoch_extractors:
+            extractor(sample)
+
+        profiler = self._profiler
+        with self._callback_lock:
+            if profiler is None:
+                self._sample_callback(sample)
+            else:
+                start = profiler.now()
+                self._sample_callback(sample)
+                profiler.record(Stage.CALLBACK, start)
+
+    def add_epoch_extractor(self, extractor: EpochExtractor) -> None:
+        """
+        Feeds the sample stream of this board to the given epoch extractor,
+        which will then cut epochs around the markers set with mark().
+        """
+        self._epoch_extractors = self._epoch_extractors + [extractor]
+
+    def remove_epoch_extractor(self, extractor: EpochExtractor) -> None:
+        self._epoch_extractors = [e for e in self._epoch_extractors
+                                  if e is not extractor]
+
+    def mark(self, label: str, timestamp: Optional[float] = None) -> None:
+        """
+        Sets an event marker on the sample stream, e.g. for an external
+        trigger. An epoch around the marker is extracted by each attached
+        epoch extractor as soon as its window has been received. Markers set
+        while no epoch extractor is attached are discarded, with a warning.
+
+        :param label: Label of the event.
+        :param timestamp: Time of the event, on the same clock as the sample
+        timestamps. Defaults to now.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        if len(self._epoch_extractors) == 0:
+            self._logger.warning(f'No epoch extractor attached, discarding '
+                                 f'marker {label} at {timestamp}.')
+            return
+
+        for extractor in self._epoch_extractors:
+            extractor.mark(label, timestamp)
+
+    def start_recording(self, fmt: SampleFormat = SampleFormat.FLOAT32,
+                        chunk_size: int = 4096) -> SampleRecorder:
+        """
+        Starts recording the sample stream of this board in compact form.
+
+        :param fmt: Format of the channel data in the recording.
+        :param chunk_size: Number of samples to allocate memory for at once.
+        :return: The SampleRecorder, from which the recorded samples can be
+        retrieved as a structured array at any time.
+        """
+        recorder = SampleRecorder(fmt, self._SAMPLES_IN_COUNTS, chunk_size)
+        self._recorders = self._recorders + [recorder]
+        return recorder
+
+    def stop_recording(self, recorder: SampleRecorder) -> None:
+        self._recorders = [r for r in self._recorders if r is not recorder]
+
+    def to_array(self, samples: Sequence[OpenBCISample],
+                 fmt: SampleFormat = SampleFormat.FLOAT32) -> np.ndarray:
+        """
+        Packs samples received from this board into a structured array, see
+        ganglion_biosensing.board.samples.pack_samples().
+        """
+        return pack_samples(samples, fmt, self._SAMPLES_IN_COUNTS)
+
+    @property
+    def samples(self) -> SampleBuffer:
+        """
+        Bounded buffer holding the most recent samples received from the
+        board, which can be consumed with a queue-like get().
+        """
+        return self._buffer
+
+    def iter_samples(self) -> Iterator[OpenBCISample]:
+        """
+        Yields samples as they arrive. Iteration ends once the board stops
+        streaming and all buffered samples have been consumed.
+        """
+        for block in self.iter_blocks(1):
+            yield block[0]
+
+    def iter_blocks(self, size: int, timeout: Optional[float] = None) \
+            -> Iterator[List[OpenBCISample]]:
+        """
+        Yields blocks of samples as they arrive. Iteration ends once the board
+        stops streaming and all buffered samples have been consumed.
+
+        :param size: Number of samples per block.
+        :param timeout: If not None, maximum time in seconds to wait for a
+        block to fill up, after which a shorter block is yielded.
+        """
+        while True:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            block = []
+            while len(block) < size:
+                wait = _POLL_INTERVAL
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                block.extend(self._buffer.get_block(size - len(block),
+                                                    max(wait, 0)))
+
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                elif not self.is_streaming and self._buffer.empty():
+                    break
+
+            if len(block) > 0:
+                yield block
+            elif not self.is_streaming:
+                return
+
+    def iter_arrays(self, size: int,
+                    fmt: SampleFormat = SampleFormat.FLOAT32,
+                    timeout: Optional[float] = None) -> Iterator[np.ndarray]:
+        """
+        Equivalent of iter_blocks(), yielding each block as a structured
+        array (see to_array()).
+        """
+        for block in self.iter_blocks(size, timeout):
+            yield self.to_array(block, fmt)
+
+    async def aiter_samples(self) -> AsyncIterator[OpenBCISample]:
+        """
+        Asynchronous equivalent of iter_samples().
+        """
+        async for block in self.aiter_blocks(1):
+            yield block[0]
+
+    async def aiter_blocks(self, size: int, timeout: Optional[float] = None) \
+            -> AsyncIterator[List[OpenBCISample]]:
+        """
+        Asynchronous equivalent of iter_blocks(). Waiting for samples doesn't
+        block the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        self._buffer.add_async_waiter(loop, event)
+        try:
+            while True:
+                deadline = None if timeout is None else loop.time() + timeout
+                while self._buffer.qsize() < size and self.is_streaming:
+                    event.clear()
+                    if self._buffer.qsize() >= size:
+                        break
+
+                    wait = _POLL_INTERVAL
+                    if deadline is not None:
+                        wait = min(wait, deadline - loop.time())
+                        if wait <= 0:
+                            break
+
+                    try:
+                        await asyncio.wait_for(event.wait(), wait)
+                    except asyncio.TimeoutError:
+                        continue
+
+                block = self._buffer.get_block(size, timeout=0)
+                if len(block) > 0:
+                    yield block
+                elif not self.is_streaming:
+                    return
+        finally:
+            self._buffer.remove_async_waiter(loop, event)
+
+    async def aiter_arrays(self, size: int,
+                           fmt: SampleFormat = SampleFormat.FLOAT32,
+                           timeout: Optional[float] = None) \
+            -> AsyncIterator[np.ndarray]:
+        """
+        Asynchronous equivalent of iter_arrays().
+        """
+        async for block in self.aiter_blocks(size, timeout):
+            yield self.to_array(block, fmt)
+
     def __enter__(self) -> BaseBiosensingBoard:
         self.connect()
         return self
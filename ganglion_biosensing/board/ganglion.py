@@ -1,51 +1,82 @@
 from __future__ import annotations
 
 import logging
+import queue
 import threading
 import time
-from typing import Any, Callable, Iterator, List, Optional, Tuple
+from typing import Any, Callable, List, Optional, Tuple
 
 import numpy as np
 from bitstring import BitArray
-from bluepy.btle import DefaultDelegate, Peripheral
+from bluepy.btle import BTLEException, DefaultDelegate, Peripheral
 
-from ganglion_biosensing.board.board import BaseBiosensingBoard, BoardType, \
-    OpenBCISample
+from ganglion_biosensing.board.board import AccelSample, \
+    BaseBiosensingBoard, BoardType, GAP_MARKER_PKT_ID, ImpedanceSample, \
+    NAN_CHANNEL_DATA, OpenBCISample
+from ganglion_biosensing.util.backoff import backoff_delays
 from ganglion_biosensing.util.bluetooth import decompress_signed, find_mac
 from ganglion_biosensing.util.constants.ganglion import GanglionCommand, \
     GanglionConstants
-
-
-# TODO: implement accelerometer reading
+from ganglion_biosensing.util.profiling import Profiler, Stage
+from ganglion_biosensing.util.timestamping import DriftCorrectingTimestamper
 
 
 class GanglionBoard(BaseBiosensingBoard):
     """
     Represents an OpenBCI Ganglion board, providing methods to access the
-    streaming data in an asynchronous manner using queues.
+    streaming data in an asynchronous manner, either through callbacks or by
+    pulling samples from an internal buffer.
 
     The easiest way to use this class is as a context manager, see the
     included examples for reference.
     """
+    _SAMPLES_IN_COUNTS = True
 
     def __init__(self,
                  mac: Optional[str] = None,
-                 callback: Optional[Callable[[OpenBCISample], Any]] = None):
+                 callback: Optional[Callable[[OpenBCISample], Any]] = None,
+                 name: Optional[str] = None,
+                 reconnect: bool = False,
+                 max_reconnect_attempts: Optional[int] = None,
+                 buffer_size: int = 2048,
+                 accelerometer: bool = False):
         """
         Initialize this board, indicating the MAC address of the target board.
 
         If the MAC address is not provided, automatic discovery will be
-        attempted, which might require root privileges.
+        attempted, which might require root privileges. Discovery results are
+        cached locally, so subsequent lookups of the same board are immediate.
 
         Note that this doesn't actually connect to the board until connect()
         is manually called (or invoked through a context manager).
 
         :param mac: MAC address of the board.
+        :param name: Name of the board to discover if no MAC address is
+        given, e.g. 'Ganglion-8819'. Defaults to the first board found.
+        :param reconnect: If True, the connection is automatically
+        re-established (with exponential backoff) when the link drops while
+        streaming. Streaming is then resumed, and a single sample with pkt_id
+        GAP_MARKER_PKT_ID is emitted to mark the outage.
+        :param max_reconnect_attempts: Maximum number of reconnection attempts
+        per outage, None for unlimited.
+        :param buffer_size: Maximum number of samples kept in the internal
+        buffer backing the samples property and the iterator methods.
+        :param accelerometer: If True, the accelerometer is enabled when
+        streaming starts, and its readings are passed to the callback set
+        with set_accel_callback().
         """
-        super().__init__()
+        super().__init__(buffer_size)
         self._logger = logging.getLogger(self.__class__.__name__)
-        self._mac_address = find_mac() if not mac else mac
+        self._mac_address = find_mac(name) if not mac else mac
         self._ganglion = None
+        self._delegate = None
+        self._raw_callback = None
+        self._accel_callback = _ignore
+        self._impedance_callback = _ignore
+        self._accelerometer = accelerometer
+        self._pending_cmds = queue.Queue()
+        self._reconnect = reconnect
+        self._max_reconnect_attempts = max_reconnect_attempts
 
         if callback:
             self._sample_callback = callback
@@ -57,15 +88,111 @@ class GanglionBoard(BaseBiosensingBoard):
             target=GanglionBoard._streaming,
             args=(self,))
 
-    def _streaming(self):
+    def _start_stream(self):
+        if self._accelerometer:
+            self._ganglion.send_command(GanglionCommand.ACCEL_ON)
         self._ganglion.send_command(GanglionCommand.STREAM_START)
+
+    def _streaming(self):
+        try:
+            self._stream_loop()
+        finally:
+            # mark the board as stopped however the loop ended, so that the
+            # sample iterators terminate
+            self._shutdown_event.set()
+
+    def _stream_loop(self):
+        self._start_stream()
         while not self._shutdown_event.is_set():
             try:
-                self._ganglion.waitForNotifications(GanglionConstants.DELTA_T)
-            except Exception as e:
-                self._logger.error('Something went wrong: ', e)
+                self._send_pending_cmds()
+                profiler = self._profiler
+                if profiler is None:
+                    self._ganglion.waitForNotifications(
+                        GanglionConstants.DELTA_T)
+                else:
+                    start = profiler.now()
+                    self._ganglion.waitForNotifications(
+                        GanglionConstants.DELTA_T)
+                    profiler.record(Stage.BLE_IO, start)
+            except BTLEException as e:
+                # only link errors warrant reconnecting; errors raised by the
+                # callbacks (which run inside waitForNotifications()) are
+                # handled below
+                self._logger.error(f'Something went wrong: {e}')
+                if not self._reconnect or not self._reestablish():
+                    return
+            except Exception:
+                self._logger.exception('Error while handling samples, '
+                                       'stopping stream.')
                 return
 
+    def _send_pending_cmds(self):
+        while not self._pending_cmds.empty():
+            cmd = self._pending_cmds.get_nowait()
+            self._ganglion.send_command(cmd)
+            if cmd == GanglionCommand.STREAM_START:
+                # the board restarts its stream, e.g. after an impedance test
+                self._delegate.mark_gap()
+
+    def send_command(self, cmd: GanglionCommand) -> None:
+        """
+        Sends a command to the board. While streaming, the command is handed
+        over to the streaming thread, which sends it between notifications.
+        """
+        if not self._shutdown_event.is_set():
+            self._pending_cmds.put(cmd)
+        elif self._ganglion:
+            self._ganglion.send_command(cmd)
+        else:
+            raise RuntimeError('Not connected to board!')
+
+    def start_impedance_test(self) -> None:
+        """
+        Puts the board in impedance test mode. EEG samples stop, and the
+        board instead sends impedance values, which are passed to the
+        callback set with set_impedance_callback().
+        """
+        self.send_command(GanglionCommand.IMP_TEST_START)
+
+    def stop_impedance_test(self) -> None:
+        """
+        Stops the impedance test mode and resumes the EEG stream. A gap marker
+        is emitted for the duration of the test.
+        """
+        self.send_command(GanglionCommand.IMP_TEST_STOP)
+        self.send_command(GanglionCommand.STREAM_START)
+
+    def _reestablish(self) -> bool:
+        """
+        Tries to re-establish the connection to the board after the link has
+        dropped, and resumes streaming.
+
+        :return: True if streaming was resumed, False if the board is shutting
+        down or the maximum number of attempts was reached.
+        """
+        self._delegate.mark_gap()
+        delays = backoff_delays(max_attempts=self._max_reconnect_attempts)
+        for attempt, delay in enumerate(delays, start=1):
+            if self._shutdown_event.wait(delay):
+                return False
+
+            self._logger.warning(f'Reconnection attempt {attempt}...')
+            self._ganglion.disconnect()
+            try:
+                self._ganglion = _GanglionPeripheral(self._mac_address)
+                self._ganglion.setDelegate(self._delegate)
+                self._start_stream()
+            except Exception as e:
+                self._logger.warning(f'Reconnection failed: {e}')
+                continue
+
+            self._logger.info('Reconnected, resuming stream.')
+            return True
+
+        self._logger.error('Giving up on reconnecting to the board.')
+        return False
+
     def connect(self) -> None:
         """
         Connect to the board.
@@ -98,13 +225,25 @@ class GanglionBoard(BaseBiosensingBoard):
     def start_streaming(self) -> None:
         """
         Initiates streaming of data from the board. Samples are
-        asynchronously stored in self.samples queue of this object.
+        asynchronously stored in self.samples buffer of this object, and
+        passed to the callback.
         """
         if not self._shutdown_event.is_set():
             self._logger.warning('Already streaming!')
         else:
-            self._ganglion.setDelegate(_GanglionDelegate(self._sample_callback))
+            self._delegate = _GanglionDelegate(self._dispatch_sample,
+                                               self._accel_callback,
+                                               self._impedance_callback)
+            self._delegate.profiler = self._profiler
+            self._delegate.invalid_callback = self._dispatch_invalid
+            self._delegate.raw_callback = self._raw_callback
+            self._ganglion.setDelegate(self._delegate)
             self._shutdown_event.clear()
+            # the previous thread might have ended on its own, without
+            # stop_streaming() being called
+            self._streaming_thread = threading.Thread(
+                target=GanglionBoard._streaming,
+                args=(self,))
             self._streaming_thread.start()
 
     def stop_streaming(self) -> None:
@@ -128,134 +267,391 @@ class GanglionBoard(BaseBiosensingBoard):
     def board_type(self) -> BoardType:
         return BoardType.GANGLION
 
+    def set_profiler(self, profiler: Optional[Profiler]) -> None:
+        super().set_profiler(profiler)
+        if self._delegate:
+            self._delegate.profiler = profiler
+
     def set_callback(self, callback: Callable[[OpenBCISample], Any]) -> None:
         if not self._shutdown_event.is_set():
             self._logger.warning('Unable to set callback while streaming.')
         else:
             super().set_callback(callback)
 
+    def set_raw_callback(self,
+                         callback: Optional[Callable[[float, bytes], Any]]) \
+            -> None:
+        """
+        Sets a callback receiving the arrival time and raw contents of every
+        packet received from the board, e.g. a RawPacketWriter to archive
+        them for later offline decoding.
+        """
+        if not self._shutdown_event.is_set():
+            self._logger.warning('Unable to set callback while streaming.')
+        else:
+            self._raw_callback = callback
+
+    def set_accel_callback(self,
+                           callback: Callable[[AccelSample], Any]) -> None:
+        """
+        Sets the callback receiving accelerometer readings. These arrive at a
+        low rate (10 Hz), and each is aligned with the seq of the EEG sample
+        received together with it. Requires the board to be created with
+        accelerometer=True.
+        """
+        if not self._shutdown_event.is_set():
+            self._logger.warning('Unable to set callback while streaming.')
+        else:
+            self._accel_callback = callback
+
+    @property
+    def impedance_callback(self) -> Callable[[ImpedanceSample], Any]:
+        return self._impedance_callback
+
+    def set_impedance_callback(self,
+                               callback: Callable[[ImpedanceSample], Any]) \
+            -> None:
+        """
+        Sets the callback receiving impedance values, which the board sends
+        while in impedance test mode. Unlike the other callbacks, this one
+        can be changed while streaming.
+        """
+        self._impedance_callback = callback
+        if self._delegate:
+            self._delegate.impedance_callback = callback
+
+
+def _ignore(*args: Any) -> None:
+    pass
+
 
 class _GanglionDelegate(DefaultDelegate):
-    def __init__(self, callback: Callable[[OpenBCISample], Any]):
+    def __init__(self,
+                 callback: Callable[[OpenBCISample], Any],
+                 accel_callback: Callable[[AccelSample], Any] = _ignore,
+                 impedance_callback: Callable[[ImpedanceSample], Any] =
+                 _ignore):
         super().__init__()
         self._last_values = np.array([0, 0, 0, 0], dtype=np.int32)
-        self._last_id = -1
+        self._last_id: Optional[int] = -1
         self._result_callback = callback
+        self._accel_callback = accel_callback
+        self.impedance_callback = impedance_callback
         self._sample_cnt = 0
-        self._timestamps = None
+        self._timestamper = DriftCorrectingTimestamper()
         self._logger = logging.getLogger(self.__class__.__name__)
         self._wait_for_full_pkt = True
+        self._in_gap = False
+        self._dropped_pkts = 0
+        self.profiler: Optional[Profiler] = None
+        self.raw_callback: Optional[Callable[[float, bytes], Any]] = None
+        # receives blocks of lost samples as (timestamps, first seq, pkt ids);
+        # if unset, they're passed to the sample callback as NaN samples
+        self.invalid_callback: \
+            Optional[Callable[[np.ndarray, int, np.ndarray], Any]] = None
+
+        self._accel_counts = np.zeros(3, dtype=np.int8)
+        self._accel_axes_seen = [False, False, False]
+        self._ascii_msg = bytearray()
+
+        # packets are dispatched on their id through a lookup table, so that
+        # decoding EEG packets doesn't pay for the checks of the rarer packet
+        # types
+        self._handlers: List[Callable[[int, bytes, float], None]] = \
+            [self._handle_unknown] * 256
+        self._handlers[0] = self._handle_uncompressed
+        for pkt_id in range(1, 201):
+            self._handlers[pkt_id] = self._handle_compressed
+        for pkt_id in range(1, 101):
+            # 18-bit packets with ids ending in 1, 2 or 3 carry the X, Y and
+            # Z accelerometer axes, respectively, in their last byte
+            if 1 <= pkt_id % 10 <= 3:
+                self._handlers[pkt_id] = self._handle_compressed_accel
+        for pkt_id in range(201, 206):
+            self._handlers[pkt_id] = self._handle_impedance
+        self._handlers[206] = self._handle_ascii
+        self._handlers[207] = self._handle_ascii
+
+    def mark_gap(self) -> None:
+        """
+        Signals that the sample stream was interrupted, e.g. because the link
+        to the board was lost. When samples flow again, a single gap marker
+        sample is emitted, and the seq counter and timestamps are advanced to
+        account for the samples lost in between.
+        """
+        self._in_gap = True
+
+    def _resume_after_gap(self, arrival_time: float) -> None:
+        if self._timestamper.is_initialized:
+            gap_start = self._timestamper.timestamp(self._sample_cnt)
+            missing = max(1, int(round((arrival_time - gap_start) /
+                                       self._timestamper.period)))
+        else:
+            gap_start = arrival_time
+            missing = 1
+
+        self._logger.warning(f'Resuming after losing ~{missing} samples.')
+        self._emit_invalid(np.array([gap_start]), self._sample_cnt,
+                           np.array([GAP_MARKER_PKT_ID]))
+
+        self._sample_cnt += missing
+
+        # don't count the packets lost during the outage as drops, and don't
+        # decode deltas until we get a new full packet
+        self._last_id = None
+        self._wait_for_full_pkt = True
+        self._in_gap = False
+
+    @property
+    def sample_count(self) -> int:
+        return self._sample_cnt
 
-    @staticmethod
-    def _timestamp_generator() -> Iterator[float]:
-        timestamp = time.time()
-        while True:
-            yield timestamp
-            timestamp = timestamp + GanglionConstants.DELTA_T
+    @property
+    def dropped_packets(self) -> int:
+        return self._dropped_pkts
 
     def handleNotification(self, cHandle, data):
         """Called when data is received. It parses the raw data from the
         Ganglion and returns an OpenBCISample object"""
+        arrival_time = time.time()
+        if self.raw_callback is not None:
+            self.raw_callback(arrival_time, data)
+
+        self.decode(data, arrival_time)
 
+    def decode(self, data: bytes, arrival_time: float) -> None:
+        """
+        Decodes a raw packet received from the Ganglion at the given time,
+        passing the resulting samples to the callbacks.
+        """
         if len(data) < 1:
             self._logger.warning('A packet should at least hold one byte...')
             return
 
-        bit_array = BitArray()
         start_byte = data[0]
+        self._handlers[start_byte](start_byte, data, arrival_time)
 
-        dropped, dummy_samples = self._upd_sample_count(start_byte)
+    def _emit_invalid(self, timestamps: np.ndarray, first_seq: int,
+                      pkt_ids: np.ndarray) -> None:
+        if self.invalid_callback is not None:
+            self.invalid_callback(timestamps, first_seq, pkt_ids)
+            return
 
-        if start_byte == 0:
-            # uncompressed sample
-            if not self._timestamps:
-                self._timestamps = _GanglionDelegate._timestamp_generator()
+        for i, (timestamp, pkt_id) in enumerate(zip(timestamps.tolist(),
+                                                    pkt_ids.tolist())):
+            self._result_callback(OpenBCISample(timestamp, first_seq + i,
+                                                pkt_id, NAN_CHANNEL_DATA))
 
-            self._wait_for_full_pkt = False
+    def restart(self) -> None:
+        """
+        Signals that a new stream is starting, e.g. when decoding an archive
+        holding several streams, which are separated by pauses of unknown
+        length. The timestamp fit is started afresh, while samples keep
+        being numbered consecutively.
+        """
+        self._timestamper.reset()
+        self._in_gap = False
+
+    def _count_samples(self, start_byte: int, arrival_time: float) \
+            -> Tuple[int, np.ndarray]:
+        profiler = self.profiler
+        if profiler is None:
+            return self._synthesize_gaps(start_byte, arrival_time)
+
+        start = profiler.now()
+        result = self._synthesize_gaps(start_byte, arrival_time)
+        profiler.record(Stage.GAP_SYNTHESIS, start)
+        return result
+
+    def _synthesize_gaps(self, start_byte: int, arrival_time: float) \
+            -> Tuple[int, np.ndarray]:
+        """
+        Advances the sample counter over the samples covered by a packet, and
+        emits the samples which can't be decoded (lost during an outage, in
+        dropped packets, or while waiting for a full packet) as invalid.
+        """
+        if self._in_gap:
+            # only resume on packets carrying samples, as impedance or ASCII
+            # packets might still arrive before the stream restarts
+            self._resume_after_gap(arrival_time)
+
+        dropped, timestamps = self._upd_sample_count(start_byte, arrival_time)
+        if start_byte != 0 and (self._wait_for_full_pkt or dropped > 0):
+            # the samples covered by this packet (including the dropped
+            # ones) can't be decoded; ids of the dropped packets wrap around
+            # within the 1-100 or 101-200 range of this packet
+            first_id = 1 if start_byte <= 100 else 101
+            pkt_ids = first_id + (start_byte - dropped - first_id +
+                                  np.arange(len(timestamps)) // 2) % 100
+            self._emit_invalid(timestamps,
+                               self._sample_cnt - len(timestamps),
+                               pkt_ids)
+        return dropped, timestamps
+
+    def _handle_uncompressed(self, start_byte: int, data: bytes,
+                             arrival_time: float) -> None:
+        _, timestamps = self._count_samples(start_byte, arrival_time)
+        self._wait_for_full_pkt = False
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.now()
+
+        bit_array = BitArray()
+        for byte in data[1:13]:
+            bit_array.append(f'0b{byte:08b}')
 
-            for byte in data[1:13]:
-                bit_array.append(f'0b{byte:08b}')
+        results = []
+        # and split it into 24-bit chunks here
+        for sub_array in bit_array.cut(24):
+            # calling '.int' interprets the value as signed 2's complement
+            results.append(sub_array.int)
 
-            results = []
-            # and split it into 24-bit chunks here
-            for sub_array in bit_array.cut(24):
-                # calling '.int' interprets the value as signed 2's complement
-                results.append(sub_array.int)
+        self._last_values = np.array(results, dtype=np.int32)
 
-            self._last_values = np.array(results, dtype=np.int32)
+        if profiler is not None:
+            profiler.record(Stage.DECODE, start)
 
-            # store the sample
-            self._result_callback(
-                OpenBCISample(next(self._timestamps),
-                              self._sample_cnt - 1,
-                              start_byte,
-                              self._last_values))
+        # store the sample
+        self._result_callback(
+            OpenBCISample(timestamps[0],
+                          self._sample_cnt - 1,
+                          start_byte,
+                          self._last_values))
+
+    def _handle_compressed(self, start_byte: int, data: bytes,
+                           arrival_time: float) -> float:
+        """
+        :return: The timestamp of the last sample carried by the packet.
+        """
+        dropped, timestamps = self._count_samples(start_byte, arrival_time)
 
-        elif 1 <= start_byte <= 200:
+        if self._wait_for_full_pkt or dropped > 0:
             if self._wait_for_full_pkt:
                 self._logger.warning('Need to wait for next full packet...')
-                for dummy in dummy_samples:
-                    self._result_callback(dummy)
-                return
-            elif dropped > 0:
+            else:
                 self._logger.error(f'Dropped {dropped} packets! '
                                    'Need to wait for next full packet...')
-
-                for dummy in dummy_samples:
-                    self._result_callback(dummy)
                 self._wait_for_full_pkt = True
-                return
-            else:
-                for byte in data[1:]:
-                    bit_array.append(f'0b{byte:08b}')
-
-                delta_1, delta_2 = decompress_signed(start_byte, bit_array)
-
-                tmp_value = self._last_values - delta_1
-                self._last_values = tmp_value - delta_2
-
-                self._result_callback(
-                    OpenBCISample(next(self._timestamps),
-                                  self._sample_cnt - 2,
-                                  start_byte, tmp_value))
-                self._result_callback(
-                    OpenBCISample(next(self._timestamps),
-                                  self._sample_cnt - 1,
-                                  start_byte,
-                                  self._last_values))
-
-    def _upd_sample_count(self, num) -> Tuple[int, List[OpenBCISample]]:
-        """Checks dropped packets"""
+            return timestamps[-1]
+
+        profiler = self.profiler
+        if profiler is not None:
+            start = profiler.now()
+
+        # 8 deltas of 18 or 19 bits each; in 18-bit packets the last byte
+        # holds accelerometer data instead
+        bit_array = BitArray()
+        for byte in data[1:19 if start_byte <= 100 else 20]:
+            bit_array.append(f'0b{byte:08b}')
+
+        delta_1, delta_2 = decompress_signed(start_byte, bit_array)
+
+        tmp_value = self._last_values - delta_1
+        self._last_values = tmp_value - delta_2
+
+        if profiler is not None:
+            profiler.record(Stage.DECODE, start)
+
+        self._result_callback(
+            OpenBCISample(timestamps[0],
+                          self._sample_cnt - 2,
+                          start_byte, tmp_value))
+        self._result_callback(
+            OpenBCISample(timestamps[1],
+                          self._sample_cnt - 1,
+                          start_byte,
+                          self._last_values))
+        return timestamps[-1]
+
+    def _handle_compressed_accel(self, start_byte: int, data: bytes,
+                                 arrival_time: float) -> None:
+        timestamp = self._handle_compressed(start_byte, data, arrival_time)
+        if len(data) < 20:
+            return
+
+        axis = start_byte % 10 - 1
+        # signed 8-bit value
+        self._accel_counts[axis] = data[19] - 256 if data[19] > 127 \
+            else data[19]
+        self._accel_axes_seen[axis] = True
+
+        if axis == 2 and all(self._accel_axes_seen):
+            # aligned with the last EEG sample carried by this packet
+            self._accel_callback(AccelSample(
+                timestamp=float(timestamp),
+                seq=self._sample_cnt - 1,
+                accel_data=self._accel_counts.astype(np.float64) *
+                           GanglionConstants.ACCEL_SCALE
+            ))
+            self._accel_axes_seen = [False, False, False]
+
+    def _handle_impedance(self, start_byte: int, data: bytes,
+                          arrival_time: float) -> None:
+        # impedance values are sent as ASCII digits terminated by a 'Z'
+        payload = bytes(data[1:])
+        try:
+            value = int(payload[:payload.index(b'Z')])
+        except ValueError:
+            self._logger.warning(f'Malformed impedance packet: {data}')
+            return
+
+        self.impedance_callback(ImpedanceSample(
+            timestamp=arrival_time,
+            # 201-204 are channels 1-4, 205 is the reference
+            channel=start_byte - 200 if start_byte < 205 else 0,
+            impedance=float(value)
+        ))
+
+    def _handle_ascii(self, start_byte: int, data: bytes,
+                      arrival_time: float) -> None:
+        # 206 carries a part of a message, 207 its end
+        self._ascii_msg.extend(data[1:])
+        if start_byte == 207:
+            message = self._ascii_msg.decode('ascii', errors='replace')
+            self._logger.info(f'Message from board: {message.strip()}')
+            self._ascii_msg = bytearray()
+
+    def _handle_unknown(self, start_byte: int, data: bytes,
+                        arrival_time: float) -> None:
+        self._logger.debug(f'Ignoring packet with unknown id {start_byte}.')
+
+    def _upd_sample_count(self, num: int, arrival_time: float) \
+            -> Tuple[int, np.ndarray]:
+        """
+        Checks dropped packets, advances the sample counter and timestamps
+        all the samples covered by this packet (including the dropped ones) in
+        one go.
+        """
+        first_seq = self._sample_cnt
         dropped = 0
-        dummy_samples = []
-        if num not in [0, 206, 207]:
-            if self._last_id == 0:
+        compressed = num != 0
+        if compressed:
+            if self._last_id is None:
+                # first packet after an outage
+                dropped = 0
+            elif self._last_id == 0:
                 if num >= 101:
                     dropped = num - 101
                 else:
                     dropped = num - 1
             else:
                 dropped = (num - self._last_id) - 1
+                if dropped < 0:
+                    # packet ids wrap around every 100 packets
+                    dropped += 100
+            self._dropped_pkts += dropped
 
-            # generate dummy samples
-            # generate NaN samples for the callback
-            dummy_samples = []
-            for i in range(dropped, -1, -1):
-                dummy_samples.extend([
-                    OpenBCISample(next(self._timestamps),
-                                  self._sample_cnt,
-                                  num - i,
-                                  np.array([np.NaN] * 4)),
-                    OpenBCISample(next(self._timestamps),
-                                  self._sample_cnt + 1,
-                                  num - i,
-                                  np.array([np.NaN] * 4))
-                ])
-                self._sample_cnt += 2
+            self._sample_cnt += 2 * (dropped + 1)
         else:
             self._sample_cnt += 1
         self._last_id = num
-        return dropped, dummy_samples
+
+        self._timestamper.observe(self._sample_cnt - 1, arrival_time)
+        timestamps = self._timestamper.timestamps(
+            first_seq, self._sample_cnt - first_seq)
+
+        return dropped, timestamps
 
 
 class _GanglionPeripheral(Peripheral):
@@ -0,0 +1,201 @@
+"""
+Compact representation of blocks of samples as structured NumPy arrays.
+
+Each record holds the timestamp, seq and pkt_id of a sample, its channel data
+in the dtype selected by a SampleFormat, and a mask flagging which channel
+values are valid. Samples lost in transmission, which are NaN-filled in
+OpenBCISamples, are stored as zeros with the corresponding valid flags unset,
+so integer formats can represent them too.
+"""
+from __future__ import annotations
+
+import threading
+from enum import Enum
+from typing import List, Sequence, TYPE_CHECKING
+
+import numpy as np
+
+from ganglion_biosensing.util.constants.ganglion import GanglionConstants
+
+if TYPE_CHECKING:
+    from ganglion_biosensing.board.board import OpenBCISample
+
+
+class SampleFormat(Enum):
+    COUNTS = 'i4'  # raw ADC counts, as int32
+    FLOAT32 = 'f4'  # microvolts, as float32
+    FLOAT64 = 'f8'  # microvolts, as float64
+
+
+def sample_dtype(fmt: SampleFormat, num_channels: int = 4) -> np.dtype:
+    """
+    :return: The structured dtype of the records for the given format.
+    """
+    return np.dtype([
+        ('timestamp', '<f8'),
+        ('seq', '<i8'),
+        ('pkt_id', '<i2'),
+        ('channel_data', '<' + fmt.value, (num_channels,)),
+        ('valid', '?', (num_channels,))
+    ])
+
+
+def _convert(values: np.ndarray, fmt: SampleFormat, in_counts: bool) \
+        -> np.ndarray:
+    """
+    Converts channel values (NaN-free) from counts or microvolts to the given
+    format.
+    """
+    if fmt == SampleFormat.COUNTS:
+        return values if in_counts else \
+            np.rint(values / GanglionConstants.UVOLTS_SCALE)
+    return values * GanglionConstants.UVOLTS_SCALE if in_counts else values
+
+
+def pack_samples(samples: Sequence[OpenBCISample],
+                 fmt: SampleFormat = SampleFormat.FLOAT32,
+                 in_counts: bool = True,
+                 num_channels: int = 4) -> np.ndarray:
+    """
+    Packs a sequence of samples into a structured array.
+
+    :param samples: The samples to pack.
+    :param fmt: Format of the channel data in the array.
+    :param in_counts: Whether the channel data of the samples is in ADC
+    counts (as delivered by GanglionBoard), or in microvolts (as delivered by
+    GanglionHubConnection).
+    :param num_channels: Number of channels per sample.
+    :return: Structured array with fields timestamp, seq, pkt_id,
+    channel_data and valid.
+    """
+    out = np.empty(len(samples), dtype=sample_dtype(fmt, num_channels))
+    if len(samples) == 0:
+        return out
+
+    out['timestamp'] = [s.timestamp for s in samples]
+    out['seq'] = [s.seq for s in samples]
+    out['pkt_id'] = [s.pkt_id for s in samples]
+
+    values = np.array([s.channel_data for s in samples], dtype=np.float64) \
+        .reshape(len(samples), num_channels)
+    valid = ~np.isnan(values)
+    out['valid'] = valid
+    out['channel_data'] = _convert(np.where(valid, values, 0.0),
+                                   fmt, in_counts)
+    return out
+
+
+class SampleRecorder:
+    """
+    Records the sample stream of a board in compact form, for long in-memory
+    sessions. Created through BaseBiosensingBoard.start_recording().
+
+    Samples are written straight into preallocated chunks of records as they
+    arrive, so no Python objects are kept around per sample, and the memory
+    used is a few dozen bytes per sample instead of a few hundred. Blocks of
+    lost samples are written as masked records directly.
+
+    Note that the recorder is fed from the regular sample path, so samples
+    are still decoded into short-lived OpenBCISamples first; it reduces the
+    memory retained by long sessions, not the allocations made while
+    acquiring.
+    """
+
+    def __init__(self,
+                 fmt: SampleFormat = SampleFormat.FLOAT32,
+                 in_counts: bool = True,
+                 chunk_size: int = 4096,
+                 num_channels: int = 4):
+        """
+        :param fmt: Format of the channel data in the recording.
+        :param in_counts: Whether the channel data of the recorded samples is
+        in ADC counts or in microvolts.
+        :param chunk_size: Number of records allocated at once.
+        :param num_channels: Number of channels per sample.
+        """
+        self._fmt = fmt
+        self._in_counts = in_counts
+        self._dtype = sample_dtype(fmt, num_channels)
+        self._chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self.clear()
+
+    @property
+    def format(self) -> SampleFormat:
+        return self._fmt
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._chunk_size * (len(self._chunks) - 1) + self._fill
+
+    def __call__(self, sample: OpenBCISample) -> None:
+        values = np.asarray(sample.channel_data)
+        if values.dtype.kind == 'f':
+            valid = ~np.isnan(values)
+            values = np.where(valid, values, 0.0)
+        else:
+            # integer counts can't be NaN
+            valid = True
+        values = _convert(values, self._fmt, self._in_counts)
+
+        with self._lock:
+            if self._fill == self._chunk_size:
+                self._chunks.append(np.empty(self._chunk_size,
+                                             dtype=self._dtype))
+                self._fill = 0
+
+            record = self._chunks[-1][self._fill]
+            record['timestamp'] = sample.timestamp
+            record['seq'] = sample.seq
+            record['pkt_id'] = sample.pkt_id
+            record['channel_data'] = values
+            record['valid'] = valid
+            self._fill += 1
+
+    def extend_invalid(self, timestamps: np.ndarray, first_seq: int,
+                       pkt_ids: np.ndarray) -> None:
+        """
+        Records a block of consecutive samples which were lost or couldn't be
+        decoded, with all their valid flags unset.
+
+        :param timestamps: Timestamps of the samples.
+        :param first_seq: Sequence number of the first sample.
+        :param pkt_ids: Packet ids of the samples.
+        """
+        done = 0
+        with self._lock:
+            while done < len(timestamps):
+                if self._fill == self._chunk_size:
+                    self._chunks.append(np.empty(self._chunk_size,
+                                                 dtype=self._dtype))
+                    self._fill = 0
+
+                count = min(len(timestamps) - done,
+                            self._chunk_size - self._fill)
+                records = self._chunks[-1][self._fill:self._fill + count]
+                records['timestamp'] = timestamps[done:done + count]
+                records['seq'] = np.arange(first_seq + done,
+                                           first_seq + done + count)
+                records['pkt_id'] = pkt_ids[done:done + count]
+                records['channel_data'] = 0
+                records['valid'] = False
+                self._fill += count
+                done += count
+
+    def to_array(self) -> np.ndarray:
+        """
+        :return: A structured array (see pack_samples()) with a copy of all
+        the samples recorded so far.
+        """
+        with self._lock:
+            return np.concatenate(self._chunks[:-1] +
+                                  [self._chunks[-1][:self._fill]])
+
+    def clear(self) -> None:
+        """
+        Discards all the samples recorded so far.
+        """
+        with self._lock:
+            self._chunks: List[np.ndarray] = \
+                [np.empty(self._chunk_size, dtype=self._dtype)]
+            self._fill = 0
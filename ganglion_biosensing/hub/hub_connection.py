@@ -4,34 +4,28 @@ import queue
 import socket
 import threading
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
 
 import numpy as np
 
 from ganglion_biosensing.board.board import BaseBiosensingBoard, BoardType, \
-    OpenBCISample
+    GAP_MARKER_PKT_ID, OpenBCISample
+from ganglion_biosensing.util.backoff import backoff_delays
 from ganglion_biosensing.util.constants.ganglion import GanglionCommand, \
     GanglionConstants
+from ganglion_biosensing.util.profiling import Stage
+from ganglion_biosensing.util.timestamping import DriftCorrectingTimestamper
 
-# data needs to be converted from raw measurements to microvolts!
-#     private final float MCP3912_Vref = 1.2f;  // reference voltage for ADC
-#     in MCP3912 set in hardware
 
-#     private final float MCP3912_gain = 1.0;  //assumed gain setting for
-#     MCP3912.  NEEDS TO BE ADJUSTABLE JM
+def _convert_count_to_uVolts(counts: Union[int, np.ndarray]) \
+        -> Union[float, np.ndarray]:
+    return counts * GanglionConstants.UVOLTS_SCALE
 
-#     private float scale_fac_uVolts_per_count = (MCP3912_Vref * 1000000.f) /
-#     (8388607.0 * MCP3912_gain * 1.5 * 51.0); //MCP3912 datasheet page 34.
-#     Gain of InAmp = 80
-
-_MCP3912_Vref = 1.2
-_MCP3912_gain = 1.0
-
-
-def _convert_count_to_uVolts(counts: int) -> float:
-    return counts * ((_MCP3912_Vref * 1000000) /
-                     (8388607.0 * _MCP3912_gain * 1.5 * 51.0))
 
+_stream_start_cmd = {
+    'type'   : 'command',
+    'command': GanglionCommand.STREAM_START.decode('utf-8')
+}
 
 _ganglion_connect_seq = [
     {
@@ -62,10 +56,34 @@ class GanglionHubConnection(BaseBiosensingBoard):
                  board_id: str,
                  hub_ip: str = '127.0.0.1',
                  hub_port: int = 10996,
-                 max_conn_attempts: int = 20):
-        super().__init__()
+                 max_conn_attempts: int = 20,
+                 reconnect: bool = False,
+                 max_reconnect_attempts: Optional[int] = None,
+                 buffer_size: int = 2048):
+        """
+        Connects to the OpenBCI Hub, which in turn handles the connection to
+        the board with the given id.
+
+        :param board_id: Name of the board, e.g. 'Ganglion-8819'.
+        :param hub_ip: Address of the Hub.
+        :param hub_port: Port of the Hub.
+        :param max_conn_attempts: Maximum number of initial connection
+        attempts to the Hub.
+        :param reconnect: If True, the connection to the Hub is automatically
+        re-established (with exponential backoff) when it drops, and the board
+        session and stream are restored. A single sample with pkt_id
+        GAP_MARKER_PKT_ID is emitted to mark the outage.
+        :param max_reconnect_attempts: Maximum number of reconnection attempts
+        per outage, None for unlimited.
+        :param buffer_size: Maximum number of samples kept in the internal
+        buffer backing the samples property and the iterator methods.
+        """
+        super().__init__(buffer_size)
         self._board_id = board_id
         self._logger = logging.getLogger(self.__class__.__name__)
+        self._hub_addr = (hub_ip, hub_port)
+        self._reconnect = reconnect
+        self._max_reconnect_attempts = max_reconnect_attempts
 
         self._sample_q = queue.Queue()
 
@@ -78,19 +96,29 @@ class GanglionHubConnection(BaseBiosensingBoard):
         self._exp_resp_types = []
         self._resp = []
 
-        self._logger.info(f'Connecting to Hub {hub_ip}:{hub_port}...')
-
         # immediately try to connect
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket = self._connect_socket(max_conn_attempts)
+
+        self._recv_thread = threading.Thread(target=self._recv_loop)
+        self._callback_thread = threading.Thread(target=self._callback_loop)
+
+        self._recv_thread.start()
+        self._callback_thread.start()
+
+    def _connect_socket(self, max_conn_attempts: int) -> socket.socket:
+        self._logger.info(f'Connecting to Hub '
+                          f'{self._hub_addr[0]}:{self._hub_addr[1]}...')
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
         attempts = 0
         while True:
             try:
                 self._logger.info(f'Connection attempt {attempts + 1}.')
-                self._socket.connect((hub_ip, hub_port))
+                sock.connect(self._hub_addr)
                 self._logger.info('Connection success.')
-                break
+                return sock
             except OSError:
                 self._logger.info('Connection failed.')
                 if attempts < max_conn_attempts:
@@ -100,14 +128,60 @@ class GanglionHubConnection(BaseBiosensingBoard):
                     continue
                 else:
                     self._logger.error('Too many connection attempts!')
-                    self._socket.close()
+                    sock.close()
                     raise
 
-        self._recv_thread = threading.Thread(target=self._recv_loop)
-        self._callback_thread = threading.Thread(target=self._callback_loop)
+    def _reestablish(self) -> bool:
+        """
+        Called from the receiving thread when the connection to the Hub has
+        dropped. Reconnects the socket with exponential backoff, and then
+        restores the board session in a separate thread (as the responses to
+        the commands need to be read by the receiving thread).
 
-        self._recv_thread.start()
-        self._callback_thread.start()
+        :return: True if the socket was reconnected, False otherwise.
+        """
+        outage_start = time.time()
+        delays = backoff_delays(max_attempts=self._max_reconnect_attempts)
+        for attempt, delay in enumerate(delays, start=1):
+            if self._shutdown.wait(delay):
+                return False
+
+            self._logger.warning(f'Reconnection attempt {attempt}...')
+            self._socket.close()
+            try:
+                self._socket = self._connect_socket(max_conn_attempts=0)
+            except OSError:
+                continue
+
+            threading.Thread(target=self._restore_session,
+                             args=(outage_start,)).start()
+            return True
+
+        self._logger.error('Giving up on reconnecting to the Hub.')
+        return False
+
+    def _restore_session(self, outage_start: float) -> None:
+        # the streaming state is kept as is while restoring, so that the
+        # sample iterators don't end during the outage
+        was_streaming = self._streaming
+        try:
+            if self._connected_to_board:
+                self._connected_to_board = False
+                self.connect()
+
+            if was_streaming:
+                # mark the outage in the sample stream before new samples
+                # start flowing in
+                self._sample_q.put({'type'      : 'gap',
+                                    'start_time': outage_start,
+                                    'end_time'  : time.time()})
+                self._send_cmds([_stream_start_cmd])
+        except (OSError, RuntimeError) as e:
+            self._logger.error(f'Could not restore board session: {e}')
+            self._streaming = False
+            return
+
+        self._logger.info('Board session restored.')
 
     def _send_cmds(self, cmds: List[Dict[str, Any]], wait_for_success=False):
         self._logger.debug(f'Sending commands: {cmds}')
@@ -153,47 +227,62 @@ class GanglionHubConnection(BaseBiosensingBoard):
         Called by the callback thread, executes the callbacks for each sample.
         """
 
-        class _Timestamper:
-            def __init__(self):
-                self._ref_tstamp = None
-
-            def timestamp(self, ref_timestamp: Optional[float] = None):
-                if self._ref_tstamp is None:
-                    if ref_timestamp:
-                        self._ref_tstamp = ref_timestamp
-                    else:
-                        self._ref_tstamp = time.time()
-
-                ret = self._ref_tstamp
-                self._ref_tstamp += GanglionConstants.DELTA_T
-
-                return ret
-
         logger = self._logger.getChild('CALLBACK')
         logger.debug('Starting callback thread...')
-        timestamper = _Timestamper()
+        # timestamps reported by the Hub are fitted against the index of each
+        # received sample, correcting for jitter and clock drift
+        timestamper = DriftCorrectingTimestamper()
+        sample_idx = 0
+        last_seq = -1
+
+        def _handle_gap(gap: Dict):
+            nonlocal sample_idx
+            logger.warning(f'Stream gap of '
+                           f'{gap["end_time"] - gap["start_time"]:0.3f}s.')
+            if timestamper.is_initialized:
+                gap_start = timestamper.timestamp(sample_idx)
+            else:
+                gap_start = gap['start_time']
+
+            # skip the indices of the samples lost during the outage, so that
+            # the fit remains valid
+            sample_idx += max(1, int(round((gap['end_time'] - gap_start) /
+                                           timestamper.period)))
+
+            self._dispatch_invalid(np.array([gap_start]), last_seq + 1,
+                                   np.array([GAP_MARKER_PKT_ID]))
 
         def _handle_sample(sample: Dict):
+            nonlocal sample_idx, last_seq
+            if sample['type'] == 'gap':
+                _handle_gap(sample)
+                return
+
             logger.debug(f'Handling sample: {sample}')
             # convert to OpenBCISample
             # timestamp comes in milliseconds, convert to seconds
-            sample_time = sample.get('timestamp', -1) / 1000.0
-            calc_time = timestamper.timestamp(sample_time)
+            if 'timestamp' in sample:
+                timestamper.observe(sample_idx, sample['timestamp'] / 1000.0)
+            else:
+                timestamper.observe(sample_idx, time.time())
+            calc_time = timestamper.timestamp(sample_idx)
+            sample_idx += 1
 
             logger.debug(f'Adjusted time for sample: {calc_time}')
 
-            channel_data = [_convert_count_to_uVolts(c) for c in
-                            sample.get('channelDataCounts', [])]
+            channel_data = _convert_count_to_uVolts(
+                np.array(sample.get('channelDataCounts', []),
+                         dtype=np.float64))
 
+            last_seq = sample.get('sampleNumber', -1)
             sample = OpenBCISample(
                 timestamp=calc_time,
-                seq=sample.get('sampleNumber', -1),
+                seq=last_seq,
                 pkt_id=-1,
-                channel_data=np.array(channel_data, dtype=np.float64)
+                channel_data=channel_data
             )
 
-            with self._callback_lock:
-                self._sample_callback(sample)
+            self._dispatch_sample(sample)
 
         while not self._shutdown.is_set():
             try:
@@ -212,6 +301,16 @@ class GanglionHubConnection(BaseBiosensingBoard):
         """
         Socket read loop.
         """
+        try:
+            self._recv_messages()
+        finally:
+            if not self._shutdown.is_set():
+                # the connection to the Hub is gone for good, mark the board
+                # as stopped so that the sample iterators terminate
+                self._streaming = False
+                self._connected_to_board = False
+
+    def _recv_messages(self):
         logger = self._logger.getChild('RECEIVE')
         logger.debug('Starting receiving thread...')
 
@@ -219,7 +318,10 @@ class GanglionHubConnection(BaseBiosensingBoard):
         while not self._shutdown.is_set():
             try:
                 # small block size since messages are short
-                data += self._socket.recv(64)
+                chunk = self._socket.recv(64)
+                if not chunk:
+                    raise ConnectionResetError('Hub closed the connection.')
+                data += chunk
 
                 # split up responses and process them
                 while True:
@@ -233,10 +335,17 @@ class GanglionHubConnection(BaseBiosensingBoard):
                     # processing
 
                     # parse the first extracted response
+                    profiler = self._profiler
+                    if profiler is not None:
+                        start = profiler.now()
+
                     message = raw_msg.decode('utf-8')
                     # self._logger.debug(f'Raw incoming message: {message}')
                     parsed_msg = json.loads(message)
 
+                    if profiler is not None:
+                        profiler.record(Stage.HUB_PARSE, start)
+
                     if parsed_msg['type'] == 'data':
                         # got a sample, put it in sample queue
                         logger.debug(f'Got a sample')
@@ -253,7 +362,13 @@ class GanglionHubConnection(BaseBiosensingBoard):
             except socket.error as e:
                 logger.debug('Socket error.')
                 logger.debug(e)
-                break
+                if self._shutdown.is_set() or not self._reconnect:
+                    break
+
+                logger.warning('Lost connection to the Hub.')
+                if not self._reestablish():
+                    break
+                data = b''
 
         logger.debug('Shut down receiving thread...')
 
@@ -319,10 +434,7 @@ class GanglionHubConnection(BaseBiosensingBoard):
         elif self._streaming:
             return
 
-        start_stream_command = {
-            'type'   : 'command',
-            'command': GanglionCommand.STREAM_START.decode('utf-8')}
-        self._send_cmds([start_stream_command])
+        self._send_cmds([_stream_start_cmd])
         self._streaming = True
 
     def stop_streaming(self) -> None:
@@ -0,0 +1,3 @@
+from .epochs import Epoch, EpochExtractor
+from .resampling import PolyphaseResampler, ResamplingStage
+from .quality import ChannelQuality, SignalQualityMonitor
@@ -0,0 +1,144 @@
+import heapq
+import itertools
+import logging
+import threading
+from typing import Any, Callable, List, NamedTuple, Tuple
+
+import numpy as np
+
+from ganglion_biosensing.board.board import OpenBCISample
+from ganglion_biosensing.util.constants.ganglion import GanglionConstants
+
+
+class Epoch(NamedTuple):
+    label: str
+    timestamp: float  # of the marker
+    times: np.ndarray  # timestamps of the samples, relative to the marker
+    data: np.ndarray  # shape (samples, channels)
+
+
+class EpochExtractor:
+    """
+    Cuts windows [tmin, tmax] around event markers out of the sample stream.
+
+    Recent samples are kept in a buffer sorted by time, so that each epoch is
+    located with two binary searches and extracted as a slice of the buffer
+    as soon as its post-stimulus window has been received. Pending markers
+    are kept in a heap, so only the earliest one needs to be checked against
+    each new sample.
+
+    Note that the data of extracted epochs are views into the internal
+    buffer, which are only valid during the callback. Copy them to keep them
+    around.
+    """
+
+    def __init__(self,
+                 callback: Callable[[Epoch], Any],
+                 tmin: float = -0.2,
+                 tmax: float = 0.8,
+                 buffer_duration: float = 10.0,
+                 num_channels: int = 4,
+                 sampling_rate: float = GanglionConstants.SAMPLING_RATE):
+        """
+        :param callback: Callable receiving each extracted Epoch.
+        :param tmin: Start of the window, relative to the marker, in seconds.
+        :param tmax: End of the window, relative to the marker, in seconds.
+        :param buffer_duration: Duration of the sample history kept, in
+        seconds. Markers older than this when they're added can't be
+        extracted.
+        :param num_channels: Number of channels per sample.
+        :param sampling_rate: Nominal sampling rate, used to size the buffer.
+        """
+        if tmax <= tmin:
+            raise ValueError('tmax needs to be larger than tmin.')
+
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._callback = callback
+        self._tmin = tmin
+        self._tmax = tmax
+
+        # samples are appended to contiguous arrays of twice the history
+        # length, which are compacted when full, so that appends are
+        # amortized O(1) and windows can be sliced out without copying
+        self._history_len = max(int(np.ceil(buffer_duration * sampling_rate)),
+                                1)
+        capacity = 2 * self._history_len
+        self._times = np.empty(capacity, dtype=np.float64)
+        self._data = np.empty((capacity, num_channels), dtype=np.float64)
+        self._start = 0
+        self._end = 0
+
+        self._lock = threading.Lock()
+        self._markers: List[Tuple[float, int, str]] = []
+        self._counter = itertools.count()
+
+    @property
+    def pending_markers(self) -> int:
+        return len(self._markers)
+
+    def mark(self, label: str, timestamp: float) -> None:
+        """
+        Adds an event marker. The corresponding epoch is extracted as soon as
+        samples up to timestamp + tmax have been received.
+        """
+        with self._lock:
+            heapq.heappush(self._markers,
+                           (timestamp, next(self._counter), label))
+
+    def __call__(self, sample: OpenBCISample) -> None:
+        self._append(sample.timestamp, sample.channel_data)
+
+    def extend(self, timestamps: np.ndarray, data: np.ndarray) -> None:
+        """
+        Adds a block of samples.
+
+        :param timestamps: Array of shape (samples,).
+        :param data: Array of shape (samples, channels).
+        """
+        for timestamp, values in zip(timestamps, data):
+            self._append(timestamp, values)
+
+    def _append(self, timestamp: float, values: np.ndarray) -> None:
+        if self._end == len(self._times):
+            self._compact()
+
+        self._times[self._end] = timestamp
+        self._data[self._end] = values
+        self._end += 1
+
+        if self._end - self._start > self._history_len:
+            self._start += 1
+
+        if len(self._markers) > 0 and \
+                self._markers[0][0] + self._tmax <= timestamp:
+            self._extract_ready(timestamp)
+
+    def _compact(self) -> None:
+        count = self._end - self._start
+        self._times[:count] = self._times[self._start:self._end]
+        self._data[:count] = self._data[self._start:self._end]
+        self._start = 0
+        self._end = count
+
+    def _extract_ready(self, latest: float) -> None:
+        times = self._times[self._start:self._end]
+        while True:
+            with self._lock:
+                if len(self._markers) == 0 or \
+                        self._markers[0][0] + self._tmax > latest:
+                    return
+                timestamp, _, label = heapq.heappop(self._markers)
+
+            if timestamp + self._tmin < times[0]:
+                self._logger.warning(f'Marker {label} at {timestamp} is older '
+                                     f'than the sample history, dropping.')
+                continue
+
+            first = np.searchsorted(times, timestamp + self._tmin, 'left')
+            last = np.searchsorted(times, timestamp + self._tmax, 'right')
+            self._callback(Epoch(
+                label=label,
+                timestamp=timestamp,
+                times=times[first:last] - timestamp,
+                data=self._data[self._start + first:self._start + last]
+            ))
@@ -0,0 +1,239 @@
+import threading
+import time
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+
+from ganglion_biosensing.board.board import ImpedanceSample, OpenBCISample
+from ganglion_biosensing.util.constants.ganglion import GanglionConstants
+
+# the ADC resolution of the Ganglion is 24 bits
+_FULL_SCALE_COUNTS = 2 ** 23
+
+
+class ChannelQuality(NamedTuple):
+    rms: float  # of the de-meaned signal
+    line_noise: float  # power at the line frequency
+    saturation: float  # ratio of samples near full scale
+    gap_ratio: float  # ratio of missing (NaN) samples
+    railed: bool
+    flat: bool
+    noisy: bool
+    gappy: bool
+
+
+class SignalQualityMonitor:
+    """
+    Tracks running signal quality statistics for each channel of the sample
+    stream: RMS, power at the line frequency, ratio of samples saturated near
+    the full scale of the ADC, and ratio of missing (NaN) samples.
+
+    Statistics are exponentially weighted moving averages updated once per
+    block of samples, with vectorized operations over all channels, so the
+    cost per block is constant in the length of the history. Attach it to a
+    board by setting it (or a callback calling it) as the sample callback,
+    or feed it blocks of samples through update().
+
+    Thresholds are in the units of the samples, by default ADC counts as
+    delivered by GanglionBoard. For GanglionHubConnection, which delivers
+    microvolts, full_scale and flat_rms need to be scaled accordingly.
+    """
+
+    def __init__(self,
+                 num_channels: int = 4,
+                 sampling_rate: float = GanglionConstants.SAMPLING_RATE,
+                 line_freq: float = 50.0,
+                 time_constant: float = 2.0,
+                 block_size: int = 20,
+                 full_scale: float = _FULL_SCALE_COUNTS,
+                 saturation_level: float = 0.99,
+                 railed_ratio: float = 0.1,
+                 flat_rms: float = 1.0,
+                 noisy_ratio: float = 0.5,
+                 gappy_ratio: float = 0.05):
+        """
+        :param num_channels: Number of channels per sample.
+        :param sampling_rate: Sampling rate, in Hz.
+        :param line_freq: Power line frequency, in Hz.
+        :param time_constant: Time constant of the moving averages, in
+        seconds.
+        :param block_size: Number of samples collected before updating the
+        statistics, when fed sample by sample.
+        :param full_scale: Full scale of the signal.
+        :param saturation_level: Fraction of the full scale above which a
+        sample is considered saturated.
+        :param railed_ratio: Saturated sample ratio above which a channel is
+        flagged as railed.
+        :param flat_rms: RMS below which a channel is flagged as flat.
+        :param noisy_ratio: Ratio of line noise power to total power above
+        which a channel is flagged as noisy.
+        :param gappy_ratio: Missing sample ratio above which a channel is
+        flagged as gappy.
+        """
+        self._num_channels = num_channels
+        self._decay = np.exp(-1.0 / (time_constant * sampling_rate))
+        self._omega = 2 * np.pi * line_freq / sampling_rate
+        self._saturation = saturation_level * full_scale
+        self._railed_ratio = railed_ratio
+        self._flat_rms = flat_rms
+        self._noisy_ratio = noisy_ratio
+        self._gappy_ratio = gappy_ratio
+
+        self._lock = threading.Lock()
+        self._initialized = np.zeros(num_channels, dtype=bool)
+        self._mean = np.zeros(num_channels)
+        self._mean_sq = np.zeros(num_channels)
+        self._line = np.zeros(num_channels, dtype=np.complex128)
+        self._saturated = np.zeros(num_channels)
+        self._gaps = np.zeros(num_channels)
+        self._phase = 0.0  # of the line frequency phasor, in radians
+
+        self._block = np.empty((block_size, num_channels))
+        self._block_fill = 0
+
+        self._impedances: List[Tuple[int, float]] = []
+        self._impedance_lock = threading.Lock()
+
+    def __call__(self, sample: OpenBCISample) -> None:
+        self._block[self._block_fill] = sample.channel_data
+        self._block_fill += 1
+        if self._block_fill == len(self._block):
+            self.update(self._block)
+            self._block_fill = 0
+
+    def update(self, block: np.ndarray) -> None:
+        """
+        Updates the statistics with a block of samples.
+
+        :param block: Array of shape (samples, channels).
+        """
+        block = np.asarray(block, dtype=np.float64)
+        n = len(block)
+        if n == 0:
+            return
+
+        # per-sample weights of the block within the moving average, newest
+        # sample weighted the most, and the decay of the previous state
+        weights = (1 - self._decay) * self._decay ** np.arange(n - 1, -1, -1)
+        old_weight = self._decay ** n
+
+        missing = np.isnan(block)
+        valid = ~missing
+        values = np.where(missing, 0.0, block)
+
+        # line frequency component, through complex demodulation
+        phasor = np.exp(-1j * (self._phase + self._omega * np.arange(n)))
+        self._phase = (self._phase + self._omega * n) % (2 * np.pi)
+
+        # weighted sums over valid samples only, renormalized per channel
+        valid_w = weights[:, np.newaxis] * valid
+        w_sum = valid_w.sum(axis=0)
+        has_data = w_sum > 0
+        norm = np.where(has_data, w_sum, 1.0)
+        block_mean = (valid_w * values).sum(axis=0) / norm
+        block_mean_sq = (valid_w * values * values).sum(axis=0) / norm
+        block_line = (valid_w * (values - block_mean)
+                      * phasor[:, np.newaxis]).sum(axis=0) / norm
+        block_saturated = (valid_w * (np.abs(values) >= self._saturation)) \
+                              .sum(axis=0) / norm
+        block_gaps = (weights[:, np.newaxis] * missing).sum(axis=0) / \
+                     weights.sum()
+
+        with self._lock:
+            # channels without previous data start from the block values
+            init = has_data & ~self._initialized
+            self._mean[init] = block_mean[init]
+            self._mean_sq[init] = block_mean_sq[init]
+            self._line[init] = block_line[init]
+            self._saturated[init] = block_saturated[init]
+            self._initialized |= has_data
+
+            # the weight given to the new block is the share of the moving
+            # average covered by its valid samples
+            alpha = np.where(has_data, w_sum / (w_sum + old_weight), 0.0)
+            alpha = np.where(init, 1.0, alpha)
+            self._mean += alpha * (block_mean - self._mean)
+            self._mean_sq += alpha * (block_mean_sq - self._mean_sq)
+            self._line += alpha * (block_line - self._line)
+            self._saturated += alpha * (block_saturated - self._saturated)
+            self._gaps = old_weight * self._gaps + \
+                         (1 - old_weight) * block_gaps
+
+    def quality(self) -> List[ChannelQuality]:
+        """
+        :return: The current quality statistics and flags for each channel.
+        """
+        with self._lock:
+            variance = np.maximum(self._mean_sq - self._mean ** 2, 0.0)
+            rms = np.sqrt(variance)
+            # a sinusoid of amplitude A demodulates to A/2
+            line_power = 2 * np.abs(self._line) ** 2
+            saturated = self._saturated.copy()
+            gaps = self._gaps.copy()
+            initialized = self._initialized.copy()
+
+        noise_ratio = np.divide(line_power, variance,
+                                out=np.zeros_like(variance),
+                                where=variance > 0)
+        return [ChannelQuality(rms=float(rms[c]),
+                               line_noise=float(line_power[c]),
+                               saturation=float(saturated[c]),
+                               gap_ratio=float(gaps[c]),
+                               railed=bool(saturated[c] > self._railed_ratio),
+                               flat=bool(initialized[c] and
+                                         rms[c] < self._flat_rms),
+                               noisy=bool(noise_ratio[c] > self._noisy_ratio),
+                               gappy=bool(gaps[c] > self._gappy_ratio))
+                for c in range(self._num_channels)]
+
+    def add_impedance(self, sample: ImpedanceSample) -> None:
+        """
+        Collects an impedance value, for use as an impedance callback.
+        """
+        with self._impedance_lock:
+            self._impedances.append((sample.channel, sample.impedance))
+
+    def measure_impedance(self, board, duration: float = 5.0) -> np.ndarray:
+        """
+        Runs the impedance test on a streaming GanglionBoard for the given
+        duration, and returns the median impedance of each electrode.
+
+        The EEG stream is interrupted during the test, and resumes afterwards.
+        The impedance callback of the board is restored once done. Impedance
+        readings are only received while streaming, so the board needs to be
+        streaming already.
+
+        :param board: A streaming GanglionBoard.
+        :param duration: Duration of the test, in seconds.
+        :return: Array with the impedances of channels 1-4 followed by the
+        reference, NaN for electrodes without readings.
+        :raises RuntimeError: If the board isn't streaming.
+        """
+        if not board.is_streaming:
+            raise RuntimeError('Board needs to be streaming to measure '
+                               'impedances!')
+
+        with self._impedance_lock:
+            self._impedances = []
+
+        previous_callback = board.impedance_callback
+        board.set_impedance_callback(self.add_impedance)
+        try:
+            board.start_impedance_test()
+            try:
+                time.sleep(duration)
+            finally:
+                board.stop_impedance_test()
+        finally:
+            board.set_impedance_callback(previous_callback)
+
+        with self._impedance_lock:
+            readings = list(self._impedances)
+
+        # the board reports the reference as channel 0, after channels 1-4
+        per_electrode: List[List[float]] = [[] for _ in range(5)]
+        for channel, impedance in readings:
+            per_electrode[channel - 1 if channel > 0 else 4].append(impedance)
+
+        return np.array([np.median(values) if len(values) > 0 else np.nan
+                         for values in per_electrode])
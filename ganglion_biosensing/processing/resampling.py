@@ -0,0 +1,258 @@
+from math import gcd
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+
+from ganglion_biosensing.board.board import OpenBCISample
+from ganglion_biosensing.util.constants.ganglion import GanglionConstants
+
+
+def design_lowpass(up: int, down: int, half_length: int = 10,
+                   rolloff: float = 0.9, beta: float = 5.0) -> np.ndarray:
+    """
+    Designs the anti-aliasing/anti-imaging FIR lowpass filter for resampling
+    by a factor up/down, as a Kaiser-windowed sinc.
+
+    :param up: Upsampling factor.
+    :param down: Downsampling factor.
+    :param half_length: Half the length of the filter, in periods of the
+    lower of the input and output rates.
+    :param rolloff: Cutoff frequency, relative to the Nyquist frequency of
+    the lower of the input and output rates.
+    :param beta: Kaiser window shape parameter.
+    :return: Filter taps at the upsampled rate, scaled for a DC gain of up.
+    """
+    num_taps = 2 * half_length * max(up, down) + 1
+    cutoff = rolloff / max(up, down)  # relative to the upsampled Nyquist
+    n = np.arange(num_taps) - (num_taps - 1) / 2.0
+    taps = cutoff * np.sinc(cutoff * n) * np.kaiser(num_taps, beta)
+    return taps * (up / taps.sum())
+
+
+class PolyphaseResampler:
+    """
+    Streaming rational resampler, changing the sampling rate of a
+    multichannel signal by a factor up/down.
+
+    Upsampling, anti-aliasing filtering and downsampling are done in a single
+    polyphase step, computing only the output samples that are actually
+    needed. The filter state is kept across blocks, so a signal can be
+    processed in blocks of arbitrary length with the same result as if it
+    were processed all at once.
+    """
+
+    def __init__(self, up: int = 1, down: int = 2, num_channels: int = 4,
+                 half_length: int = 10, rolloff: float = 0.9,
+                 beta: float = 5.0):
+        """
+        :param up: Upsampling factor.
+        :param down: Downsampling factor.
+        :param num_channels: Number of channels in the signal.
+        :param half_length: Half the length of the filter, in periods of the
+        lower rate, trading off filter sharpness against delay and
+        computational cost.
+        :param rolloff: Filter cutoff, relative to the Nyquist frequency of the
+        lower rate.
+        :param beta: Kaiser window shape parameter.
+        """
+        if up < 1 or down < 1:
+            raise ValueError('Resampling factors need to be positive.')
+
+        factor = gcd(up, down)
+        self._up = up // factor
+        self._down = down // factor
+
+        taps = design_lowpass(self._up, self._down, half_length,
+                              rolloff, beta)
+        self._delay = (len(taps) - 1) / (2.0 * self._up)
+
+        # polyphase components: row i holds taps i, i + up, i + 2 up, ...
+        self._taps_per_phase = -(-len(taps) // self._up)
+        taps = np.pad(taps, (0, self._taps_per_phase * self._up - len(taps)))
+        self._phases = taps.reshape(self._taps_per_phase, self._up).T.copy()
+
+        # the last taps_per_phase - 1 input samples, needed to compute the
+        # next outputs
+        self._history = np.zeros((self._taps_per_phase - 1, num_channels))
+        self._in_count = 0
+        self._out_count = 0
+
+    @property
+    def up(self) -> int:
+        return self._up
+
+    @property
+    def down(self) -> int:
+        return self._down
+
+    @property
+    def delay(self) -> float:
+        """
+        Group delay of the filter, in input samples.
+        """
+        return self._delay
+
+    @property
+    def input_count(self) -> int:
+        return self._in_count
+
+    @property
+    def output_count(self) -> int:
+        return self._out_count
+
+    def output_positions(self, first: int, count: int) -> np.ndarray:
+        """
+        Positions in time of a range of output samples, in (fractional)
+        input sample indices, compensated for the filter delay.
+
+        :param first: Index of the first output sample.
+        :param count: Number of output samples.
+        """
+        k = np.arange(first, first + count)
+        return k * (self._down / self._up) - self.delay
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """
+        Resamples a block of the input signal.
+
+        :param block: Array of shape (samples, channels).
+        :return: Array of shape (output samples, channels) with all the output
+        samples that can be computed with the input received so far.
+        """
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim == 1:
+            block = block[:, np.newaxis]
+
+        buf = np.concatenate((self._history, block))
+        # global input index of buf[0]
+        buf_start = self._in_count - len(self._history)
+        self._in_count += len(block)
+
+        # output k lies at upsampled index k * down, and can be computed once
+        # input (k * down) // up has been received; all such outputs are
+        # emitted right away, as the history only reaches back far enough for
+        # outputs based on later inputs
+        out_end = (self._in_count * self._up - 1) // self._down + 1
+        k = np.arange(self._out_count, out_end)
+        self._out_count = max(out_end, self._out_count)
+
+        self._history = buf[len(buf) - len(self._history):]
+        if len(k) == 0:
+            return np.empty((0, block.shape[1]))
+
+        upsampled_idx = k * self._down
+        phase = upsampled_idx % self._up
+        base = upsampled_idx // self._up - buf_start
+
+        # (outputs, taps) indices into buf, and the matching coefficients
+        idx = base[:, np.newaxis] - np.arange(self._taps_per_phase)
+        return np.einsum('kt,ktc->kc', self._phases[phase], buf[idx])
+
+
+class ResamplingStage:
+    """
+    Resamples the sample stream of a board, forwarding resampled
+    OpenBCISamples to a callback. Attach it to a board by setting it as its
+    callback:
+
+        board.set_callback(ResamplingStage(my_callback, up=1, down=4))
+
+    Incoming samples are collected into blocks, which are then resampled
+    for all channels at once. Output samples get consecutive seq numbers,
+    a pkt_id of -1, and timestamps interpolated from the input timestamps and
+    compensated for the filter delay.
+    """
+
+    def __init__(self,
+                 callback: Callable[[OpenBCISample], Any],
+                 up: int = 1,
+                 down: int = 2,
+                 block_size: Optional[int] = None,
+                 num_channels: int = 4,
+                 nominal_period: float = GanglionConstants.DELTA_T,
+                 **filter_kwargs):
+        """
+        :param callback: Callable receiving the resampled samples.
+        :param up: Upsampling factor.
+        :param down: Downsampling factor.
+        :param block_size: Number of input samples to collect before
+        resampling them, trading off latency for efficiency. Defaults to the
+        downsampling factor.
+        :param num_channels: Number of channels per sample.
+        :param nominal_period: Nominal sampling period of the input, used to
+        extrapolate timestamps until two input samples have been received.
+        :param filter_kwargs: Passed on to PolyphaseResampler.
+        """
+        self._callback = callback
+        self._resampler = PolyphaseResampler(up, down, num_channels,
+                                             **filter_kwargs)
+        self._block_size = block_size or self._resampler.down
+        self._nominal_period = nominal_period
+        self._pending: List[OpenBCISample] = []
+
+        # timestamps of the input samples still needed for interpolation
+        self._ts_history = np.empty(0)
+        self._ts_start = 0  # input index of _ts_history[0]
+
+    @property
+    def resampler(self) -> PolyphaseResampler:
+        return self._resampler
+
+    def __call__(self, sample: OpenBCISample) -> None:
+        self._pending.append(sample)
+        if len(self._pending) >= self._block_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Resamples all pending input samples.
+        """
+        if len(self._pending) == 0:
+            return
+
+        pending, self._pending = self._pending, []
+        first_in = self._resampler.input_count
+        data = np.array([s.channel_data for s in pending], dtype=np.float64)
+        timestamps = np.array([s.timestamp for s in pending],
+                              dtype=np.float64)
+
+        first_out = self._resampler.output_count
+        out = self._resampler.process(data)
+        if len(out) == 0:
+            self._update_ts_history(first_in, timestamps)
+            return
+
+        positions = self._resampler.output_positions(first_out, len(out))
+
+        self._update_ts_history(first_in, timestamps)
+        ts_idx = np.arange(self._ts_start,
+                           self._ts_start + len(self._ts_history))
+        out_ts = np.interp(positions, ts_idx, self._ts_history)
+
+        # extrapolate linearly for positions before the first input sample
+        if len(self._ts_history) > 1:
+            period = (self._ts_history[-1] - self._ts_history[0]) / \
+                     (len(self._ts_history) - 1)
+        else:
+            period = self._nominal_period
+        early = positions < self._ts_start
+        out_ts[early] = self._ts_history[0] + \
+                        (positions[early] - self._ts_start) * period
+
+        for i in range(len(out)):
+            self._callback(OpenBCISample(float(out_ts[i]),
+                                         first_out + i,
+                                         -1,
+                                         out[i]))
+
+    def _update_ts_history(self, first_in: int, timestamps: np.ndarray) \
+            -> None:
+        self._ts_history = np.concatenate((self._ts_history, timestamps))
+        self._ts_start = first_in + len(timestamps) - len(self._ts_history)
+
+        # only keep as many timestamps as the next outputs can reach back
+        ratio = self._resampler.down / self._resampler.up
+        keep = len(timestamps) + int(np.ceil(self._resampler.delay + ratio)) + 1
+        if len(self._ts_history) > keep:
+            self._ts_start += len(self._ts_history) - keep
+            self._ts_history = self._ts_history[-keep:]
@@ -0,0 +1,23 @@
+from typing import Iterator, Optional
+
+
+def backoff_delays(initial_delay: float = 0.5,
+                   max_delay: float = 30.0,
+                   max_attempts: Optional[int] = None,
+                   factor: float = 2.0) -> Iterator[float]:
+    """
+    Generates the delays to wait before each attempt of an exponential
+    backoff retry loop.
+
+    :param initial_delay: Delay before the first attempt, in seconds.
+    :param max_delay: Upper bound for the delay between attempts.
+    :param max_attempts: Total number of attempts, None for unlimited.
+    :param factor: Multiplier applied to the delay after each attempt.
+    :return: Iterator over the delays, in seconds.
+    """
+    delay = initial_delay
+    attempts = 0
+    while max_attempts is None or attempts < max_attempts:
+        yield delay
+        delay = min(delay * factor, max_delay)
+        attempts += 1
@@ -1,32 +1,193 @@
-from typing import Iterable, Tuple
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
 
 import numpy as np
 from bitstring import BitArray
-from bluepy.btle import Scanner
+from bluepy.btle import DefaultDelegate, ScanEntry, Scanner
 
+_GANGLION_NAME_PREFIX = 'Ganglion'
+_MAC_CACHE_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'ganglion_biosensing', 'macs.json')
+_MAC_CACHE_TTL = 24 * 3600.0  # seconds
 
-def find_mac() -> str:
+
+class _MACCache:
     """
-    Scans for nearby Ganglion board, and returns the MAC address of the
-    first one detected.
+    Persistent mapping of Ganglion board names to MAC addresses.
+
+    Entries are stored on disk as JSON together with the time they were last
+    seen, and are ignored once they are older than the configured TTL.
+    """
+
+    def __init__(self, path: str = _MAC_CACHE_PATH,
+                 ttl: float = _MAC_CACHE_TTL):
+        self._path = path
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self._path, 'r') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, names: Optional[Iterable[str]] = None) -> Dict[str, str]:
+        """
+        Returns the fresh cache entries, optionally restricted to the given
+        board names.
+        """
+        now = time.time()
+        with self._lock:
+            entries = self._load()
+
+        if names is not None:
+            entries = {n: entries[n] for n in names if n in entries}
+
+        return {name: entry['mac'] for name, entry in entries.items()
+                if now - entry.get('seen', 0) <= self._ttl}
+
+    def update(self, macs: Dict[str, str]) -> None:
+        now = time.time()
+        with self._lock:
+            entries = self._load()
+            entries.update({name: {'mac': mac, 'seen': now}
+                            for name, mac in macs.items()})
+            try:
+                os.makedirs(os.path.dirname(self._path), exist_ok=True)
+                with open(self._path, 'w') as fp:
+                    json.dump(entries, fp, indent=2)
+            except OSError as e:
+                # the cache is an optimization, failing to write it is fine
+                self._logger.debug(f'Could not write MAC cache: {e}')
+
+    def clear(self) -> None:
+        with self._lock:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+
+
+mac_cache = _MACCache()
+
+
+class _GanglionScanDelegate(DefaultDelegate):
+    """
+    Collects Ganglion advertisements as they arrive during a scan, so that
+    the scan can be stopped as soon as enough boards have been seen.
+    """
+
+    def __init__(self, names: Optional[Iterable[str]] = None):
+        super().__init__()
+        self._names = set(names) if names is not None else None
+        self.found: Dict[str, str] = {}
+
+    def handleDiscovery(self, dev: ScanEntry, isNewDev: bool,
+                        isNewData: bool) -> None:
+        name = dev.getValueText(ScanEntry.COMPLETE_LOCAL_NAME)
+        if not name or not name.startswith(_GANGLION_NAME_PREFIX):
+            return
+        elif self._names is not None and name not in self._names:
+            return
+
+        self.found[name] = dev.addr
+
+
+def find_macs(count: int = 1,
+              names: Optional[Iterable[str]] = None,
+              timeout: float = 10.0,
+              use_cache: bool = True) -> Dict[str, str]:
+    """
+    Scans for nearby Ganglion boards, returning as soon as the requested
+    boards have been seen or the timeout expires.
+
+    If names are given, the scan waits for those specific boards (and count is
+    ignored), otherwise it waits for the first count boards advertising.
+    For named lookups, fresh entries in the local MAC cache are used to skip
+    scanning for the boards they cover. Unnamed lookups always scan, so that
+    only boards which are actually nearby are returned.
 
     Requires root!
 
-    :return: MAC address of the first Ganglion device discovered.
+    :param count: Number of boards to wait for when no names are given.
+    :param names: Names of the specific boards to look for.
+    :param timeout: Maximum duration of the scan, in seconds.
+    :param use_cache: Whether to use and update the local MAC cache.
+    :return: Dictionary mapping board names to MAC addresses.
+    :raises OSError: If no board, or not all of the named boards, could be
+    found.
     """
-    scanner = Scanner()
-    devices = scanner.scan()
-    gang_macs = []
-    for dev in devices:
-        for adtype, desc, value in dev.getScanData():
-            if desc == 'Complete Local Name' and value.startswith(
-                    'Ganglion'):
-                gang_macs.append(dev.addr)
+    requested = list(names) if names is not None else None
+    names = requested
+    wanted = len(names) if names is not None else count
+
+    cached = {}
+    if use_cache and names is not None:
+        cached = mac_cache.get(names)
+        if len(cached) == len(names):
+            return cached
+
+        # only scan for the boards we don't already know about
+        names = [n for n in names if n not in cached]
+        wanted = len(names)
+
+    delegate = _GanglionScanDelegate(names)
+    scanner = Scanner().withDelegate(delegate)
+
+    deadline = time.monotonic() + timeout
+    scanner.clear()
+    scanner.start()
+    try:
+        while len(delegate.found) < wanted:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            scanner.process(timeout=min(remaining, 0.1))
+    finally:
+        scanner.stop()
+
+    if use_cache and len(delegate.found) > 0:
+        mac_cache.update(delegate.found)
 
-    if len(gang_macs) < 1:
+    found = {**cached, **delegate.found}
+    if requested is not None:
+        missing = [n for n in requested if n not in found]
+        if len(missing) > 0:
+            raise OSError(f'Ganglion board(s) not found: {", ".join(missing)}')
+    elif len(found) < 1:
         raise OSError('No nearby Ganglion board discovered.')
-    else:
-        return gang_macs[0]
+    elif len(found) < count:
+        logging.getLogger('find_macs').warning(
+            f'Only {len(found)} of {count} Ganglion boards discovered.')
+
+    return found
+
+
+def find_mac(name: Optional[str] = None,
+             timeout: float = 10.0,
+             use_cache: bool = True) -> str:
+    """
+    Scans for nearby Ganglion board, and returns the MAC address of the
+    first one detected (or of the one with the given name).
+
+    Requires root!
+
+    :param name: Name of the board to look for, e.g. 'Ganglion-8819'.
+    :param timeout: Maximum duration of the scan, in seconds.
+    :param use_cache: Whether to use and update the local MAC cache.
+    :return: MAC address of the first Ganglion device discovered.
+    """
+    names = [name] if name else None
+    macs = find_macs(count=1, names=names, timeout=timeout,
+                     use_cache=use_cache)
+    return next(iter(macs.values()))
 
 
 def decompress_signed(pkt_id: int, bit_array: BitArray) \
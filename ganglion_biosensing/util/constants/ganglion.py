@@ -11,6 +11,8 @@ class _GanglionConstants(NamedTuple):
     BLE_CHAR_SEND: str
     BLE_CHAR_DISCONNECT: str
     NOTIF_UUID: int
+    ACCEL_SCALE: float
+    UVOLTS_SCALE: float
 
 
 GanglionConstants = _GanglionConstants(
@@ -21,7 +23,12 @@ GanglionConstants = _GanglionConstants(
     BLE_CHAR_RECEIVE='2d30c082f39f4ce6923f3484ea480596',
     BLE_CHAR_SEND='2d30c083f39f4ce6923f3484ea480596',
     BLE_CHAR_DISCONNECT='2d30c084f39f4ce6923f3484ea480596',
-    NOTIF_UUID=0x2902
+    NOTIF_UUID=0x2902,
+    ACCEL_SCALE=0.016,  # g per count
+    # uV per count: ADC reference voltage of 1.2V, at 24 bits, with a gain of
+    # 1.0 on the MCP3912 and of 1.5 * 51 on the front-end instrumentation
+    # amplifier (MCP3912 datasheet, page 34)
+    UVOLTS_SCALE=(1.2 * 1000000) / (8388607.0 * 1.0 * 1.5 * 51.0)
 )
 
 
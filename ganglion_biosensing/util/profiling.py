@@ -0,0 +1,181 @@
+import collections
+import logging
+import sys
+import threading
+from enum import Enum
+from time import perf_counter_ns
+from typing import Any, Callable, Counter, Dict, Iterable, List, NamedTuple, \
+    Optional, Tuple
+
+
+class Stage(Enum):
+    """
+    Stage boundaries of the acquisition path instrumented by the profiling
+    hooks.
+
+    BLE_IO spans whole waitForNotifications() calls, and thus include the
+    DECODE, GAP_SYNTHESIS and CALLBACK spans of the notifications handled
+    within them. Likewise, GAP_SYNTHESIS covers sample counting and the
+    emission of NaN samples for lost ones, including the CALLBACK spans of
+    those samples.
+    """
+    BLE_IO = 'ble_io'
+    DECODE = 'decode'
+    GAP_SYNTHESIS = 'gap_synthesis'
+    HUB_PARSE = 'hub_parse'
+    CALLBACK = 'callback'
+
+
+# sinks are called with the stage, the start of the span and its duration,
+# both in nanoseconds as given by time.perf_counter_ns()
+ProfilingSink = Callable[[Stage, int, int], Any]
+
+
+class Profiler:
+    """
+    Collects perf_counter_ns() spans at the stage boundaries of the
+    acquisition path and forwards them to a sink. Attach it to a board with
+    board.set_profiler(); when no profiler is attached the hooks reduce to a
+    single None check per stage.
+    """
+
+    def __init__(self, sink: ProfilingSink):
+        """
+        :param sink: Callable receiving (stage, start_ns, duration_ns) for
+        each recorded span, e.g. an AggregatingSink or a LoggingSink.
+        """
+        self._sink = sink
+
+    @staticmethod
+    def now() -> int:
+        return perf_counter_ns()
+
+    def record(self, stage: Stage, start_ns: int) -> None:
+        """
+        Records a span for the given stage, from start_ns until now.
+        """
+        self._sink(stage, start_ns, perf_counter_ns() - start_ns)
+
+
+class StageStats(NamedTuple):
+    count: int
+    total_ns: int
+    min_ns: int
+    max_ns: int
+
+    @property
+    def mean_ns(self) -> float:
+        return self.total_ns / self.count if self.count > 0 else 0.0
+
+
+class AggregatingSink:
+    """
+    Profiling sink keeping running count, total, min and max duration per
+    stage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[Stage, StageStats] = {}
+
+    def __call__(self, stage: Stage, start_ns: int, duration_ns: int) -> None:
+        with self._lock:
+            stats = self._stats.get(stage)
+            if stats is None:
+                self._stats[stage] = StageStats(1, duration_ns,
+                                                duration_ns, duration_ns)
+            else:
+                self._stats[stage] = StageStats(
+                    stats.count + 1,
+                    stats.total_ns + duration_ns,
+                    min(stats.min_ns, duration_ns),
+                    max(stats.max_ns, duration_ns))
+
+    def stats(self) -> Dict[Stage, StageStats]:
+        with self._lock:
+            return dict(self._stats)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+class LoggingSink:
+    """
+    Profiling sink logging every span.
+    """
+
+    def __init__(self, logger: Optional[logging.Logger] = None,
+                 level: int = logging.DEBUG):
+        self._logger = logger or logging.getLogger(self.__class__.__name__)
+        self._level = level
+
+    def __call__(self, stage: Stage, start_ns: int, duration_ns: int) -> None:
+        self._logger.log(self._level,
+                         f'{stage.value}: {duration_ns / 1000.0:0.1f}us')
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler which periodically samples the stacks of running
+    threads from a background thread, counting the functions they are
+    executing. Can be started and stopped at any time, e.g. while a board is
+    streaming.
+    """
+
+    def __init__(self, interval: float = 0.001):
+        """
+        :param interval: Sampling interval, in seconds.
+        """
+        self._interval = interval
+        self._counts: Counter[Tuple[str, str]] = collections.Counter()
+        self._thread_ids: Optional[List[int]] = None
+        self._stop = threading.Event()
+        self._stop.set()
+        self._thread = None
+
+    def start(self, threads: Optional[Iterable[threading.Thread]] = None) \
+            -> None:
+        """
+        Starts sampling.
+
+        :param threads: Threads to sample, by default all threads.
+        """
+        if not self._stop.is_set():
+            return
+
+        self._thread_ids = [t.ident for t in threads] \
+            if threads is not None else None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample_loop,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _sample_loop(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self._interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                elif self._thread_ids is not None and \
+                        thread_id not in self._thread_ids:
+                    continue
+
+                code = frame.f_code
+                self._counts[(code.co_filename, code.co_name)] += 1
+
+    def top(self, n: int = 10) -> List[Tuple[Tuple[str, str], int]]:
+        """
+        :return: The n most frequently sampled (filename, function) pairs,
+        together with their sample counts.
+        """
+        return self._counts.most_common(n)
+
+    def reset(self) -> None:
+        self._counts.clear()
@@ -0,0 +1,144 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+from ganglion_biosensing.util.constants.ganglion import GanglionConstants
+
+
+class DriftCorrectingTimestamper:
+    """
+    Maps sample indices to host clock timestamps, continuously correcting for
+    the drift between the board and host clocks.
+
+    Each observation pairs the index of the most recently received sample
+    with its arrival time. The linear model t = offset + period * index is
+    fitted to these observations incrementally, using exponentially weighted
+    least squares so that old observations are gradually forgotten. Whole
+    blocks of samples are then timestamped at once with the current fit.
+    """
+
+    def __init__(self,
+                 nominal_period: float = GanglionConstants.DELTA_T,
+                 memory: float = 60.0,
+                 min_span: float = 1.0,
+                 max_drift: float = 0.05):
+        """
+        :param nominal_period: Nominal sampling period, in seconds.
+        :param memory: Time constant, in seconds, with which old observations
+        are forgotten.
+        :param min_span: Minimum time span, in seconds, the observations need
+        to cover before the period is estimated from them. Until then, the
+        nominal period is used.
+        :param max_drift: Maximum relative deviation of the estimated period
+        from the nominal one.
+        """
+        self._nominal = nominal_period
+        self._tau = memory / nominal_period  # in samples
+        self._min_span = min_span / nominal_period  # in samples
+        self._max_drift = max_drift
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forgets all observations.
+        """
+        # weighted sums, relative to the reference point (_ref_idx, _ref_t)
+        self._ref_idx: Optional[int] = None
+        self._ref_t = 0.0
+        self._w = 0.0
+        self._sx = 0.0
+        self._sy = 0.0
+        self._sxx = 0.0
+        self._sxy = 0.0
+
+        self._offset = 0.0  # timestamp of _ref_idx
+        self._period = self._nominal
+        self._last_t: Optional[float] = None
+
+    @property
+    def period(self) -> float:
+        """
+        Current estimate of the sampling period, in seconds.
+        """
+        return self._period
+
+    @property
+    def is_initialized(self) -> bool:
+        return self._ref_idx is not None
+
+    def observe(self, index: int, arrival_time: float) -> None:
+        """
+        Adds an observation to the fit.
+
+        :param index: Index of the latest received sample.
+        :param arrival_time: Host time at which that sample was received.
+        """
+        if self._ref_idx is None:
+            self._ref_idx = index
+            self._ref_t = arrival_time
+            self._offset = arrival_time
+
+        # move the reference point to the new observation, so that the sums
+        # stay well conditioned, and decay the old observations
+        dx = index - self._ref_idx
+        dy = arrival_time - self._ref_t
+        decay = math.exp(-max(dx, 0) / self._tau)
+        w, sx, sy = self._w, self._sx, self._sy
+        self._sxx = decay * (self._sxx - 2 * dx * sx + w * dx * dx)
+        self._sxy = decay * (self._sxy - dx * sy - dy * sx + w * dx * dy)
+        self._sx = decay * (sx - w * dx)
+        self._sy = decay * (sy - w * dy)
+        self._w = decay * w
+        self._ref_idx = index
+        self._ref_t = arrival_time
+
+        # add the new observation, which sits at (0, 0)
+        self._w += 1.0
+
+        mean_x = self._sx / self._w
+        mean_y = self._sy / self._w
+        var_x = self._sxx / self._w - mean_x * mean_x
+        if var_x > (self._min_span * self._min_span) / 12.0:
+            # (the variance of a uniform spread over min_span samples)
+            cov_xy = self._sxy / self._w - mean_x * mean_y
+            period = cov_xy / var_x
+            lim = self._nominal * self._max_drift
+            self._period = min(max(period, self._nominal - lim),
+                               self._nominal + lim)
+
+        self._offset = self._ref_t + mean_y - self._period * mean_x
+
+    def timestamps(self, first_index: int, count: int) -> np.ndarray:
+        """
+        Timestamps a block of consecutive samples.
+
+        Timestamps are guaranteed to increase monotonically across calls,
+        even as the fit is updated.
+
+        :param first_index: Index of the first sample in the block.
+        :param count: Number of samples in the block.
+        :return: Array of timestamps, in seconds.
+        """
+        if count < 1:
+            return np.empty(0, dtype=np.float64)
+        elif self._ref_idx is None:
+            raise RuntimeError('No observations to timestamp samples with.')
+
+        steps = np.arange(count, dtype=np.float64)
+        first = self._offset + self._period * (first_index - self._ref_idx)
+        timestamps = first + self._period * steps
+
+        if self._last_t is not None and timestamps[0] <= self._last_t:
+            min_step = self._nominal * (1.0 - self._max_drift)
+            timestamps = np.maximum(timestamps,
+                                    self._last_t + min_step * (steps + 1))
+
+        self._last_t = timestamps[-1]
+        return timestamps
+
+    def timestamp(self, index: int) -> float:
+        """
+        Timestamps a single sample.
+        """
+        return float(self.timestamps(index, 1)[0])
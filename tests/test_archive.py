@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from bitstring import BitArray
+
+from ganglion_biosensing.board.archive import RawPacketWriter, \
+    _decode_chunk, decode_archive, read_packets
+
+
+def _uncompressed(values):
+    bits = BitArray()
+    for value in values:
+        bits.append(BitArray(int=value, length=24))
+    return bytes([0]) + bits.bytes
+
+
+def _compressed(pkt_id, deltas):
+    # deltas of two samples, in the sign-magnitude-like encoding of the board
+    width = 19 if pkt_id > 100 else 18
+    bits = BitArray()
+    for delta in deltas:
+        bits.append(BitArray(uint=delta if delta >= 0 else -delta + 1,
+                             length=width))
+    payload = bits.bytes
+    return bytes([pkt_id]) + payload + bytes(19 - len(payload))
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """
+    Archive with several streams separated by pauses, with jittered arrival
+    times, clock drift and a dropped packet.
+    """
+    path = str(tmp_path / 'capture.raw')
+    rng = np.random.default_rng(0)
+    t = 1000.0
+    with RawPacketWriter(path) as writer:
+        for stream in range(6):
+            writer(t, _uncompressed([stream, 2, 3, 4]))
+            for k in range(1500):
+                if stream == 3 and k == 50:
+                    continue
+                writer(t + rng.uniform(0.0, 0.02),
+                       _compressed(101 + k % 100, [2, 0, -1, 0] * 2))
+                t += 0.01002
+            t += 5.0  # pause before the next stream
+    return path
+
+
+def test_parallel_decode_matches_sequential(archive):
+    sequential = _decode_chunk(archive, 0, len(read_packets(archive))).decoded
+    parallel = decode_archive(archive, workers=3, chunks_per_worker=2)
+
+    np.testing.assert_array_equal(parallel.seq, sequential.seq)
+    np.testing.assert_array_equal(parallel.pkt_id, sequential.pkt_id)
+    np.testing.assert_array_equal(parallel.channel_data,
+                                  sequential.channel_data)
+    np.testing.assert_array_equal(parallel.timestamps, sequential.timestamps)
+    assert parallel.dropped_packets == sequential.dropped_packets == 1
+
+
+def test_timestamps_follow_stream_restarts(archive):
+    decoded = decode_archive(archive, workers=2)
+    records = read_packets(archive)
+    keyframes = records['arrival_time'][records['data'][:, 0] == 0]
+
+    np.testing.assert_array_equal(decoded.seq, np.arange(len(decoded.seq)))
+    assert np.all(np.diff(decoded.timestamps) > 0)
+    restarts = decoded.timestamps[decoded.pkt_id == 0]
+    np.testing.assert_allclose(restarts, keyframes, atol=0.05)
+
+
+def test_truncated_archive(archive):
+    count = len(read_packets(archive))
+    with open(archive, 'ab') as fp:
+        fp.write(b'\x01\x02\x03')
+
+    with pytest.warns(UserWarning):
+        assert len(read_packets(archive)) == count
+
+    with RawPacketWriter(archive) as writer:
+        writer(0.0, _uncompressed([0, 0, 0, 0]))
+    assert len(read_packets(archive)) == count + 1
@@ -0,0 +1,38 @@
+import numpy as np
+
+from ganglion_biosensing.board.board import OpenBCISample
+from ganglion_biosensing.board.ganglion import _GanglionDelegate
+
+
+def _compressed(pkt_id):
+    # two samples with zero deltas
+    return bytes([pkt_id]) + bytes(19)
+
+
+def _decode(packets):
+    samples = []
+    delegate = _GanglionDelegate(samples.append)
+    delegate.decode(bytes(13), 0.0)  # uncompressed packet, all zeros
+    for i, pkt_id in enumerate(packets, start=1):
+        delegate.decode(_compressed(pkt_id), i * 0.01)
+    return samples, delegate
+
+
+def test_dropped_packet_ids_wrap_around():
+    for first, last in ((99, 2), (199, 102)):
+        base = 1 if first <= 100 else 101
+        samples, delegate = _decode(list(range(base, first + 1)) + [last])
+        lost = [s for s in samples if np.isnan(s.channel_data).all()]
+
+        assert delegate.dropped_packets == 2
+        assert [s.pkt_id for s in lost] == \
+               [base + 99, base + 99, base, base, last, last]
+        assert [s.seq for s in samples] == list(range(len(samples)))
+
+
+def test_samples_are_contiguous():
+    samples, delegate = _decode(range(101, 201))
+    assert delegate.dropped_packets == 0
+    assert all(isinstance(s, OpenBCISample) for s in samples)
+    assert not any(np.isnan(s.channel_data).any() for s in samples)
+    assert np.all(np.diff([s.timestamp for s in samples]) > 0)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from ganglion_biosensing.board.board import OpenBCISample
+from ganglion_biosensing.processing.resampling import PolyphaseResampler, \
+    ResamplingStage, design_lowpass
+
+_RATIOS = [(1, 2), (1, 4), (2, 1), (3, 4), (4, 3), (2, 3), (5, 2)]
+
+
+def _reference(signal: np.ndarray, up: int, down: int) -> np.ndarray:
+    # zero-stuffing, direct convolution and decimation
+    taps = design_lowpass(up, down)
+    upsampled = np.zeros((len(signal) * up, signal.shape[1]))
+    upsampled[::up] = signal
+    filtered = np.stack([np.convolve(upsampled[:, c], taps)[:len(upsampled)]
+                         for c in range(signal.shape[1])], axis=1)
+    return filtered[::down]
+
+
+@pytest.mark.parametrize('up,down', _RATIOS)
+@pytest.mark.parametrize('block_size', [1, 3, 7])
+def test_streaming_matches_one_shot(up, down, block_size):
+    signal = np.random.default_rng(0).standard_normal((240, 4))
+
+    one_shot = PolyphaseResampler(up, down).process(signal)
+
+    resampler = PolyphaseResampler(up, down)
+    streamed = np.concatenate([resampler.process(signal[i:i + block_size])
+                               for i in range(0, len(signal), block_size)])
+
+    expected = _reference(signal, resampler.up, resampler.down)
+    assert len(one_shot) == len(streamed) == len(expected)
+    np.testing.assert_allclose(one_shot, expected, atol=1e-12)
+    np.testing.assert_allclose(streamed, expected, atol=1e-12)
+
+
+@pytest.mark.parametrize('up,down', _RATIOS)
+def test_stage_timestamps_increase(up, down):
+    outputs = []
+    stage = ResamplingStage(outputs.append, up=up, down=down, block_size=1)
+    for i in range(100):
+        stage(OpenBCISample(100.0 + i * 0.005, i, 0, np.zeros(4)))
+
+    timestamps = np.array([s.timestamp for s in outputs])
+    assert np.all(np.diff(timestamps) > 0)
+    np.testing.assert_allclose(np.diff(timestamps), 0.005 * down / up)
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from ganglion_biosensing.util.timestamping import DriftCorrectingTimestamper
+
+_PERIOD = 0.005
+
+
+def _observe(timestamper, period, duration, jitter=0.0, start=1000.0,
+             seed=0):
+    # one observation per packet of two samples, delayed by up to jitter
+    rng = np.random.default_rng(seed)
+    indices = np.arange(1, int(duration / period), 2)
+    for index in indices:
+        timestamper.observe(int(index), start + index * period +
+                            rng.uniform(0.0, jitter))
+    return indices
+
+
+def test_nominal_period_until_min_span():
+    timestamper = DriftCorrectingTimestamper(_PERIOD, min_span=1.0)
+    _observe(timestamper, _PERIOD * 1.01, 0.5)
+    assert timestamper.period == _PERIOD
+
+
+def test_estimates_drift():
+    true_period = _PERIOD * 1.003
+    timestamper = DriftCorrectingTimestamper(_PERIOD)
+    indices = _observe(timestamper, true_period, 60.0, jitter=0.004)
+
+    assert timestamper.period == pytest.approx(true_period, rel=1e-4)
+    # timestamps follow the arrival times, up to the mean jitter
+    last = int(indices[-1])
+    expected = 1000.0 + last * true_period + 0.002
+    assert timestamper.timestamp(last + 1) - true_period == \
+           pytest.approx(expected, abs=1e-3)
+
+
+def test_drift_is_bounded():
+    timestamper = DriftCorrectingTimestamper(_PERIOD, max_drift=0.05)
+    _observe(timestamper, _PERIOD * 1.5, 10.0)
+    assert timestamper.period == pytest.approx(_PERIOD * 1.05)
+
+
+def test_timestamps_are_monotonic():
+    timestamper = DriftCorrectingTimestamper(_PERIOD, max_drift=0.05)
+    timestamper.observe(0, 1000.0)
+    first = timestamper.timestamps(0, 10)
+
+    # the host clock steps back, which moves the fit into the past
+    timestamper.observe(20, 999.0)
+    second = timestamper.timestamps(10, 10)
+
+    assert np.all(np.diff(np.concatenate((first, second))) > 0)
+    assert np.all(np.diff(second) >= _PERIOD * 0.95 - 1e-12)
+    assert second[0] - first[-1] >= _PERIOD * 0.95 - 1e-12
+
+
+def test_block_matches_single_timestamps():
+    block = DriftCorrectingTimestamper(_PERIOD)
+    single = DriftCorrectingTimestamper(_PERIOD)
+    for timestamper in (block, single):
+        _observe(timestamper, _PERIOD * 0.998, 5.0, jitter=0.002)
+
+    expected = block.timestamps(1000, 8)
+    actual = [single.timestamp(index) for index in range(1000, 1008)]
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(np.diff(expected), block.period)
+
+
+def test_edge_cases():
+    timestamper = DriftCorrectingTimestamper(_PERIOD)
+    assert len(timestamper.timestamps(0, 0)) == 0
+    with pytest.raises(RuntimeError):
+        timestamper.timestamps(0, 1)
+
+    timestamper.observe(0, 1000.0)
+    assert timestamper.is_initialized
+    timestamper.reset()
+    assert not timestamper.is_initialized